@@ -0,0 +1,88 @@
+import os
+
+import oraql_settings
+
+# Core set of the runs started by this process, set by assignCpus
+_assigned_cpus = None
+
+def parseCpuList(text):
+    '''
+    CPUs in the list format of taskset and /sys, e.g. "0-3,8,10-11".
+    '''
+    cpus = []
+    for part in str(text).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def nodeCpus(node):
+    with open(f'/sys/devices/system/node/node{node}/cpulist', 'r') as fd:
+        return parseCpuList(fd.read())
+
+def benchmarkCpus(benchmark):
+    '''
+    The CPUs runs of `benchmark` may use: "cpus" of the benchmark file, else
+    the CPUs of its "numa_node", else all CPUs this process may run on.
+    '''
+    if "cpus" in benchmark:
+        cpus = parseCpuList(benchmark.cpus)
+    elif "numa_node" in benchmark:
+        cpus = nodeCpus(benchmark.numa_node)
+    else:
+        cpus = os.sched_getaffinity(0)
+    return sorted(set(cpus) & os.sched_getaffinity(0))
+
+def coreSets(benchmark, count):
+    '''
+    Split the CPUs of `benchmark` into `count` disjoint core sets, one for
+    each run that may happen at the same time. Each set has "cpus_per_run"
+    CPUs if the benchmark file says so, otherwise the CPUs are divided
+    evenly. Returns None if nothing is to be pinned: a benchmark file without
+    CPU settings and either a single run or fewer CPUs than runs.
+    '''
+    configured = any(key in benchmark for key in ["cpus", "cpus_per_run", "numa_node"])
+    cpus = benchmarkCpus(benchmark)
+    if not configured and (count == 1 or len(cpus) < count):
+        return None
+    per_run = benchmark.cpus_per_run if "cpus_per_run" in benchmark else len(cpus) // count
+    per_run = max(1, min(per_run, len(cpus)))
+    if per_run * count > len(cpus):
+        raise ValueError(f'{count} concurrent runs with {per_run} CPUs each '
+                         f'do not fit on the {len(cpus)} CPUs {cpus}')
+    return [cpus[i * per_run:(i + 1) * per_run] for i in range(count)]
+
+def assignCpus(cpus):
+    '''
+    Make the runs started by this process use the core set `cpus`.
+    '''
+    global _assigned_cpus
+    _assigned_cpus = cpus
+
+def assignedCpus():
+    return _assigned_cpus
+
+def runSettings(benchmark, cmd):
+    '''
+    `cmd` as it should be run for `benchmark`, with the environment and the
+    CPUs to run it on. The environment is the one of the driver updated
+    with the "env" of the benchmark file; OMP_NUM_THREADS defaults to the
+    size of the core set. With a "numa_node", memory is bound to that node
+    through numactl.
+    '''
+    env = None
+    if "env" in benchmark or _assigned_cpus:
+        env = dict(os.environ)
+        if _assigned_cpus:
+            env['OMP_NUM_THREADS'] = str(len(_assigned_cpus))
+        if "env" in benchmark:
+            env.update({k: str(v) for k, v in benchmark.env.items()})
+    if "numa_node" in benchmark:
+        cmd = [oraql_settings.numactlcommand,
+               f'--membind={benchmark.numa_node}'] + cmd
+    return cmd, env, _assigned_cpus
@@ -0,0 +1,152 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import subprocess as sp
+import logging as log
+
+import oraql_affinity
+
+logger = log.getLogger('oraql_batch')
+logger.setLevel(log.INFO)
+ch = log.StreamHandler()
+ch.setFormatter(log.Formatter('%(asctime)s - %(levelname)-10s - %(message)s',
+                              datefmt='%b %d, %H:%M:%S'))
+logger.addHandler(ch)
+
+DRIVERS = ['chunked', 'simple', 'identify_important']
+
+class Job:
+    '''
+    The search for one benchmark file, run by a driver in a process of its
+    own in the directory of the benchmark file. The driver exits nonzero if
+    the search failed.
+    '''
+    def __init__(self, benchmark_file):
+        self.benchmark_file = os.path.abspath(benchmark_file)
+        self.base_path = os.path.dirname(self.benchmark_file)
+        self.log_path = f'{self.benchmark_file}.log'
+        self.process = None
+        self.log = None
+        self.cpus = None
+        self.start = None
+        self.result = None
+
+    def launch(self, driver_cmd, cpus):
+        self.cpus = cpus
+        self.log = open(self.log_path, 'w')
+        self.start = time.time()
+        self.process = sp.Popen(driver_cmd + [os.path.basename(self.benchmark_file)],
+                                cwd=self.base_path, stdout=self.log, stderr=sp.STDOUT,
+                                stdin=sp.DEVNULL,
+                                preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None)
+
+    def finish(self, returncode):
+        '''
+        Collect the outcome once the driver exited.
+        '''
+        self.process.returncode = returncode
+        self.log.close()
+        final = None
+        with open(self.log_path, 'r', errors='replace') as fd:
+            for line in fd:
+                m = re.search(r'Final sequence: (.*)$', line)
+                if m:
+                    final = m.group(1)
+        self.result = {'returncode': self.process.returncode,
+                       'seconds': round(time.time() - self.start, 1),
+                       'cpus': self.cpus, 'log': self.log_path,
+                       'final_sequence': final}
+        return self.result
+
+def coreBudget(cpus, per_benchmark, concurrent):
+    '''
+    Split the CPUs of the batch into one core set per benchmark that may
+    run at the same time.
+    '''
+    per_benchmark = per_benchmark or len(cpus) // concurrent
+    if per_benchmark < 1 or per_benchmark * concurrent > len(cpus):
+        raise ValueError(f'{concurrent} concurrent benchmarks with '
+                         f'{per_benchmark} CPUs each do not fit on the '
+                         f'{len(cpus)} CPUs {cpus}')
+    return [cpus[i * per_benchmark:(i + 1) * per_benchmark] for i in range(concurrent)]
+
+def runBatch(benchmark_files, driver_cmd, core_sets, summary_path):
+    '''
+    Run the searches of `benchmark_files`, one per core set at a time, and
+    write their outcome to `summary_path`. Searches of benchmark files in
+    the same directory run one after another, since they write their build
+    products, versions and final executables under the same names.
+    '''
+    pending = [Job(benchmark_file) for benchmark_file in benchmark_files]
+    running = dict()
+    free = list(core_sets)
+    results = dict()
+    try:
+        while pending or running:
+            for job in list(pending):
+                if not free:
+                    break
+                if any(other.base_path == job.base_path for other in running.values()):
+                    continue
+                pending.remove(job)
+                cpus = free.pop(0)
+                logger.info(f'Start {job.benchmark_file} on CPUs {cpus}, log @ {job.log_path}')
+                job.launch(driver_cmd, cpus)
+                running[job.process.pid] = job
+            pid, status = os.wait()
+            job = running.pop(pid, None)
+            if job is None:
+                continue
+            result = job.finish(os.waitstatus_to_exitcode(status))
+            free.append(job.cpus)
+            results[job.benchmark_file] = result
+            logger.info(f'Finished {job.benchmark_file} after {result["seconds"]}s, '
+                        f'exit code {result["returncode"]}, final sequence {result["final_sequence"]}')
+    finally:
+        for job in running.values():
+            job.process.kill()
+    with open(summary_path, 'w') as fd:
+        json.dump(results, fd, indent=2)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the searches of several '
+                                     'benchmark files at the same time, on '
+                                     'disjoint sets of CPUs.',
+                                     epilog='Arguments after -- are passed on '
+                                     'to the driver, e.g. -- -j 4 --run-jobs 1')
+    parser.add_argument('benchmark_files', nargs='+')
+    parser.add_argument('--driver', choices=DRIVERS, default='chunked')
+    parser.add_argument('-c', '--concurrent', type=int,
+                        help='number of benchmarks to search at the same time, '
+                             'by default as many as there are files, up to the '
+                             'number of CPUs')
+    parser.add_argument('--cpus',
+                        help='CPUs the batch may use, e.g. 0-15, by default '
+                             'all CPUs this process may run on')
+    parser.add_argument('--cpus-per-benchmark', type=int,
+                        help='CPUs of each benchmark, by default the CPUs are '
+                             'divided evenly')
+    parser.add_argument('--summary', default='oraql-batch.json',
+                        help='file the outcome of every search is written to')
+    argv = sys.argv[1:]
+    driver_args = []
+    if '--' in argv:
+        argv, driver_args = argv[:argv.index('--')], argv[argv.index('--') + 1:]
+    args = parser.parse_args(argv)
+
+    cpus = (oraql_affinity.parseCpuList(args.cpus) if args.cpus
+            else sorted(os.sched_getaffinity(0)))
+    concurrent = args.concurrent or min(len(args.benchmark_files), len(cpus))
+    try:
+        core_sets = coreBudget(cpus, args.cpus_per_benchmark, concurrent)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    driver = os.path.join(os.path.dirname(os.path.abspath(__file__)), f'oraql_{args.driver}.py')
+    results = runBatch(args.benchmark_files, [sys.executable, driver] + driver_args,
+                       core_sets, args.summary)
+    sys.exit(0 if all(r['returncode'] == 0 for r in results.values()) else 1)
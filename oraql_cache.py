@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import hashlib
+import shutil
+import logging
+import sqlite3
+
+import oraql_settings
+import oraql_events
+import oraql_command
+import oraql_fingerprint
+
+logger = logging.getLogger('')
+
+def benchmarkScope(benchmark):
+    '''
+    Hash of everything besides the executable that decides whether a run
+    passes: the inputs, the expected outputs and the way the executable is
+    run. Results are only shared between benchmarks with the same scope.
+    '''
+    description = benchmark.toDict()
+    scope = hashlib.sha1()
+    scope.update(json.dumps([description.get('verify_cmd'),
+                             description.get('input_output_pairs')],
+                            sort_keys=True).encode())
+    for iop in benchmark.input_output_pairs:
+        if os.path.isfile(iop.output):
+            with open(iop.output, 'rb') as fd:
+                scope.update(fd.read())
+    return scope.hexdigest()
+
+class ResultCache:
+    '''
+    Persistent map from an executable hash to the outcome of running it:
+    pass/fail, the problem sizes and, if measured, the runtime. Backed by a
+    SQLite database so that results survive restarts and can be shared by
+    concurrent worker processes. Holds at most `max_entries` results and
+    evicts the least recently used ones.
+    '''
+    def __init__(self, path, scope, max_entries=None):
+        self.path = os.path.abspath(path)
+        self.scope = scope
+        self.max_entries = max_entries or oraql_settings.resultcache_entries
+        self._db = None
+        self._pid = None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def _connection(self):
+        # connections must not be shared with forked worker processes
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=600)
+            self._db.execute('CREATE TABLE IF NOT EXISTS results ('
+                             'scope TEXT, hash TEXT, entry TEXT, '
+                             'last_used REAL, PRIMARY KEY (scope, hash))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_lru '
+                             'ON results (last_used)')
+            self._db.commit()
+            self._pid = os.getpid()
+        return self._db
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def get(self, key):
+        db = self._connection()
+        with db:
+            row = db.execute('SELECT entry FROM results WHERE scope = ? AND '
+                             'hash = ?', (self.scope, key)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE results SET last_used = ? WHERE scope = ? AND '
+                       'hash = ?', (time.time(), self.scope, key))
+        return json.loads(row[0])
+
+    def __setitem__(self, key, entry):
+        db = self._connection()
+        with db:
+            db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                       (self.scope, key, json.dumps(entry), time.time()))
+            db.execute('DELETE FROM results WHERE rowid IN (SELECT rowid FROM '
+                       'results ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                       (self.max_entries,))
+
+def openResultCache(benchmark, base_path=None):
+    path = os.path.join(base_path or os.curdir, oraql_settings.cachedir,
+                        'results.sqlite')
+    return ResultCache(path, benchmarkScope(benchmark))
+
+def mergeProblemSizes(problemsizes, cached):
+    '''
+    Problem sizes only grow during a search. Update `problemsizes` in place
+    with the ones stored for a cached result and return it.
+    '''
+    for path, size in cached.items():
+        if path in problemsizes:
+            problemsizes[path] = max(size, problemsizes[path])
+    return problemsizes
+
+def fileDigest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def objectsFingerprint(link_cmd, objects):
+    '''
+    Fingerprint of what linking with `link_cmd` produces from `objects`:
+    the command and the contents of the objects. Only meaningful while the
+    other inputs of the link, e.g. objects make builds from files that are
+    not searched, stay the same.
+    '''
+    digest = hashlib.sha1(json.dumps(link_cmd).encode())
+    for path in objects:
+        digest.update(fileDigest(path).encode())
+    return digest.hexdigest()
+
+def commandKey(tools, options, source_path):
+    '''
+    Key for the output of compiling `source_path` with `options` using the
+    list of `tools`. Tools are identified by the binary they resolve to, so
+    rebuilding the toolchain invalidates the cached products.
+    '''
+    stamps = []
+    for tool in tools:
+        binary = shutil.which(tool) or tool
+        stamp = None
+        if os.path.isfile(binary):
+            stat = os.stat(binary)
+            stamp = (binary, stat.st_size, stat.st_mtime_ns)
+        stamps.append((tool, stamp))
+    return hashlib.sha1(json.dumps([stamps, options, source_path])
+                        .encode()).hexdigest()
+
+def depfileOptions(source_path, depfile):
+    '''
+    Options that make the compiler list the inputs of `source_path` in
+    `depfile`, for the languages where all our compilers support it.
+    '''
+    if source_path.endswith(('.c', '.cc', '.cpp', '.cxx', '.C')):
+        return ['-MMD', '-MF', depfile]
+    return []
+
+def readDeps(source_path, depfile):
+    if os.path.isfile(depfile):
+        return readDepfile(depfile)
+    return [source_path]
+
+def objectPath(options, source_path):
+    '''
+    The object file a compile of `source_path` with `options` and `-c`
+    writes: the argument of `-o`, or the source name in the working directory.
+    '''
+    if '-o' in options[:-1]:
+        return options[options.index('-o') + 1]
+    return os.path.splitext(os.path.basename(source_path))[0] + '.o'
+
+def readDepfile(depfile):
+    '''
+    Inputs listed in a make-style dependency file written by `-MMD -MF`.
+    '''
+    with open(depfile, 'r') as fd:
+        content = fd.read().replace('\\\n', ' ')
+    return content.split(':', 1)[1].split()
+
+class BuildCache:
+    '''
+    Build products kept on disk below `path`, keyed by the command that
+    produced them. Together with a product, the digests of the source files
+    it was built from are stored; a product is only reused while all of
+    them are unchanged. `limits` maps a suffix to the number of products
+    with it that are kept, evicting the least recently used ones.
+    '''
+    def __init__(self, path, limits=None):
+        self.path = os.path.abspath(path)
+        self.limits = limits if limits is not None else oraql_settings.buildcache_limits
+        os.makedirs(self.path, exist_ok=True)
+
+    def _files(self, key, suffix):
+        return (os.path.join(self.path, f'{key}{suffix}'),
+                os.path.join(self.path, f'{key}.json'))
+
+    def lookup(self, key, suffix):
+        '''
+        Returns the path of the cached product and the extra data stored
+        with it, or (None, None).
+        '''
+        product, meta = self._files(key, suffix)
+        if not os.path.isfile(product) or not os.path.isfile(meta):
+            return None, None
+        try:
+            with open(meta, 'r') as fd:
+                meta = json.load(fd)
+            for dep, digest in meta['deps'].items():
+                if fileDigest(dep) != digest:
+                    return None, None
+            # mark the product as recently used for eviction
+            os.utime(product)
+        except (OSError, ValueError, KeyError):
+            return None, None
+        return product, meta.get('extra')
+
+    def restore(self, key, suffix, target):
+        '''
+        Copy the cached product to `target`. Returns whether it was found
+        and the extra data stored with it.
+        '''
+        product, extra = self.lookup(key, suffix)
+        if product is None:
+            return False, None
+        try:
+            shutil.copy(product, target)
+        except OSError:
+            # evicted by a concurrent worker in the meantime
+            return False, None
+        return True, extra
+
+    def store(self, key, suffix, built, deps, extra=None):
+        '''
+        Copy the product `built` into the cache and return the cached path.
+        Files are replaced atomically, so concurrent workers and interrupted
+        runs never see partial products.
+        '''
+        product, meta = self._files(key, suffix)
+        tmp = f'{product}.{os.getpid()}.tmp'
+        shutil.copy(built, tmp)
+        os.replace(tmp, product)
+        with open(f'{meta}.{os.getpid()}.tmp', 'w') as fd:
+            json.dump({'deps': {dep: fileDigest(dep) for dep in deps},
+                       'extra': extra}, fd)
+        os.replace(f'{meta}.{os.getpid()}.tmp', meta)
+        if suffix in self.limits:
+            self._evict(suffix, self.limits[suffix])
+        return product
+
+    def _evict(self, suffix, keep):
+        products = []
+        for name in os.listdir(self.path):
+            if name.endswith(suffix):
+                try:
+                    products.append((os.path.getmtime(os.path.join(self.path, name)), name))
+                except OSError:
+                    # removed by a concurrent worker
+                    pass
+        for _, name in sorted(products, reverse=True)[keep:]:
+            key = name[:-len(suffix)]
+            for path in self._files(key, suffix):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+def openBuildCache(base_path=None):
+    return BuildCache(os.path.join(base_path or os.curdir,
+                                   oraql_settings.cachedir, 'build'))
+
+def linkOrReuse(benchmark, objects, link, linked, results, builds):
+    '''
+    Link the executable of `benchmark` from `objects` with `link`, which
+    returns False if linking failed, and return its hash, or None if linking
+    failed. `linked` maps the fingerprints of the objects linked before to
+    the hashes of their executables. If the objects are the same as for an
+    executable whose result is in the result cache `results`, linking is
+    skipped: a failed executable need not exist, a successful one is
+    restored from the build cache `builds`.
+    '''
+    fingerprint = objectsFingerprint(oraql_command.buildCommand(benchmark, objects), objects)
+    md5sum = linked.get(fingerprint)
+    seen = results.get(md5sum) if md5sum else None
+    reused = seen is not None and not seen["res"]
+    if seen is not None and seen["res"]:
+        reused, _ = builds.restore(md5sum, '.exe', benchmark.executable)
+    oraql_events.cacheLookup('objects', reused)
+    if reused:
+        logger.debug(f'    Objects are the same as for executable {md5sum}, skip linking')
+        return md5sum
+    if not link(benchmark):
+        return None
+    with oraql_events.phase('hash'):
+        md5sum = oraql_fingerprint.executableFingerprint(benchmark.executable)
+    linked[fingerprint] = md5sum
+    return md5sum
@@ -1,7 +1,18 @@
 import json
 import dotmap
 import oraql_settings
+import oraql_parallel
+import oraql_distributed
+import oraql_cache
+import oraql_seq
+import oraql_search
+import oraql_verify
+import oraql_affinity
+import oraql_events
+import oraql_command
+import oraql_provenance
 import sys
+import argparse
 import os
 import shutil
 import logging as log
@@ -52,14 +63,6 @@ ch.setLevel(log.DEBUG if DEBUG_CONSOLE else log.INFO)
 ch.setFormatter(formatter)
 logger.addHandler(ch)
 
-def str_BinListAsHex(l):
-    # pad list so it has at least length 1
-    l += [0] * (1 - len(l))
-    # interpret input list `l` as bits in a binary number
-    num = int("".join([str(x) for x in l]), 2)
-    # return as hex string
-    return format(num, 'x')
-
 def readBenchmarkFile(benchmark_file):
     if not os.path.isfile(benchmark_file):
         logger.error(f'Benchmark file @ {benchmark_file} does not exist')
@@ -74,46 +77,93 @@ def readBenchmarkFile(benchmark_file):
         return None
 
 # Returns true on failure
-def runCompileCmd(cmd_args):
-    logger.debug(f'RUNNING {cmd_args}')
-    run_result = sp.run(cmd_args, shell=True, stdout=PIPE, stderr=PIPE)
+def runCompileCmd(cmd_args, phase):
+    logger.debug(f'RUNNING {oraql_command.commandLine(cmd_args)}')
+    try:
+        with oraql_parallel.stage('compile'), oraql_events.phase(phase):
+            run_result = oraql_command.run(cmd_args, stdout=PIPE, stderr=PIPE)
+    except OSError as e:
+        # without a shell, a missing tool raises instead of exiting with 127
+        logger.warning(f'   - Compile error:\n'
+                       f'     - Command: {oraql_command.commandLine(cmd_args)}\n'
+                       f'     - {e!s}')
+        return False
+    oraql_events.exitCode(phase, run_result.returncode)
     if run_result.returncode != 0:
-        logger.debug(f'   - Compile error, exit code was {run_result.returncode} and command was:\n{cmd_args}')
+        logger.debug(f'   - Compile error, exit code was {run_result.returncode} and command was:\n{oraql_command.commandLine(cmd_args)}')
         return False
     return run_result
 
+def compileBitcode(compiler, options, source_path, btc_outfile):
+    '''
+    Run the frontend for `source_path`. Its output does not depend on the
+    sequence, so it is built once and later probes reuse the cached bitcode.
+    Returns the path of the bitcode, or None if the frontend failed.
+    '''
+    btc_options = [*options, '-O3', '-emit-llvm']
+    key = oraql_cache.commandKey([compiler], btc_options, source_path)
+    bitcode, _ = _build_cache.lookup(key, '.bc')
+    oraql_events.cacheLookup('bitcode', bitcode is not None)
+    if bitcode:
+        logger.debug(f'  Reusing frontend bitcode of {source_path}')
+        return bitcode
+
+    depfile = btc_outfile + '.d'
+    dep_options = oraql_cache.depfileOptions(source_path, depfile)
+    if not runCompileCmd([*oraql_command.splitCommand(compiler), *btc_options, *dep_options,
+                          '-o', btc_outfile, source_path], 'frontend'):
+        return None
+    deps = oraql_cache.readDeps(source_path, depfile)
+    return _build_cache.store(key, '.bc', btc_outfile, deps)
+
 def compileFile(benchmark, source_file, seqfile):
-    compiler = oraql_settings.clangcommand
+    compiler = oraql_command.sourceCompiler(benchmark, source_file)
     opt = oraql_settings.optcommand
-    if source_file.path.endswith('.cc') or source_file.path.endswith('.cpp') or source_file.path.endswith('.cu'):
-        compiler =  oraql_settings.clangppcommand
-    if source_file.path.endswith('.f90') or source_file.path.endswith('.F90'):
-        compiler = oraql_settings.flangcommand
-    if "compiler" in benchmark:
-        compiler = benchmark.compiler
 
     file_base = source_file.path.rsplit(".", 1)[0]
     print(seqfile.readline())
 
-    options = source_file.options + benchmark.options
+    options = oraql_command.compilerOptions(source_file.options + benchmark.options)
     btc_outfile = file_base + '.bc'
     btc_opt_outfile = file_base + '.opt.bc'
     o_outfile = file_base + '.o'
-    btc_options = " ".join([*options, '-O3', '-emit-llvm', '-o', btc_outfile])
-    o_options = " ".join([*options, '-o', o_outfile]) #'-O3',
+    o_options = [*options, '-o', o_outfile] #'-O3',
 
     try:
         # insert opt 
-        if not runCompileCmd(f'{compiler} {btc_options} {source_file.path}'):
+        bitcode = compileBitcode(compiler, options, source_file.path, btc_outfile)
+        if not bitcode:
             return False, 0
-        run_result = runCompileCmd(f'{opt} @{seqfile.name} {btc_outfile} -o {btc_opt_outfile}')
+        # the object only depends on the bitcode and the sequence, reuse it
+        # if this file was compiled with the same sequence before
+        with open(seqfile.name, 'r') as fd:
+            opt_options = fd.read()
+        key = oraql_cache.commandKey([opt, compiler], [opt_options, o_options], source_file.path)
+        # the compiler has to run if the queries are to be indexed and this
+        # revision of the source file is not yet
+        revision = None
+        if oraql_settings.provenanceoption and oraql_settings.provenanceoption in opt_options:
+            revision = oraql_provenance.revision(benchmark, source_file)
+            if (source_file.path, revision) in _provenance:
+                revision = None
+        reused, problemsize = (_build_cache.restore(key, '.o', o_outfile) if revision is None
+                               else (False, None))
+        oraql_events.cacheLookup('object', reused)
+        if reused:
+            logger.debug(f'  Reusing object file of {source_file.path}')
+            return True, problemsize
+        run_result = runCompileCmd([*oraql_command.splitCommand(opt), f'@{seqfile.name}', bitcode,
+                                    '-o', btc_opt_outfile], 'opt')
         if not run_result:
             return False, 0
-        if not runCompileCmd(f'{compiler} {o_options} {btc_opt_outfile}'):
+        if revision is not None:
+            queries = oraql_provenance.parseQueries(run_result.stderr.decode('utf-8', errors='replace'))
+            logger.debug(f'  Indexed the provenance of {len(queries)} queries of {source_file.path}')
+            _provenance.store(source_file.path, revision, queries)
+        if not runCompileCmd([*oraql_command.splitCommand(compiler), *o_options, btc_opt_outfile], 'codegen'):
             return False, 0
     except Exception as e:
-        logger.warning(f'   - Compile error:\n'
-                       f'     - Command: {cmd}\n'
+        logger.warning(f'   - Compile error of {source_file.path}:\n'
                        f'     - {e!s}')
         return False, 0
     pattern_aacall = "(\d+) optimisticaa\s+- Number of optimisticAA alias calls"
@@ -125,8 +175,12 @@ def compileFile(benchmark, source_file, seqfile):
     except Exception as e:
         logger.warning(f'Did not find optimistic AA statistics in compiler stderr. Did you build LLVM with OptimisticAA support?')
         return False, 0
+    _build_cache.store(key, '.o', o_outfile, [bitcode], problemsize)
     return True, problemsize
 
+def objectFiles(benchmark):
+    return [sf.path.rsplit(".", 1)[0] + '.o' for sf in benchmark.source_files]
+
 def linkExecutable(benchmark):
     executable_path = benchmark.executable
     if os.path.isfile(executable_path):
@@ -134,30 +188,33 @@ def linkExecutable(benchmark):
         os.remove(executable_path)
 
     try: 
-        cmd = [benchmark.make_cmd]
-        run_result = sp.run(cmd, stdout=sp.DEVNULL, stderr=sp.DEVNULL, shell=True)
+        cmd = oraql_command.buildCommand(benchmark, objectFiles(benchmark))
+        logger.debug(f'  Link with {oraql_command.commandLine(cmd)}')
+        with oraql_parallel.stage('link'), oraql_events.phase('link'):
+            run_result = oraql_command.run(cmd, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+        oraql_events.exitCode('link', run_result.returncode)
         if run_result.returncode != 0:
             logger.warn(f'   - Make command error, exit code was '
                         f'{run_result.returncode}:\n'
-                        f'     - Command: {" ".join(cmd)}')
+                        f'     - Command: {oraql_command.commandLine(cmd)}')
             return False
     except Exception as e:
         logger.warn(f'   - Make command error:\n'
-                    f'     - Command: {" ".join(cmd)}\n'
+                    f'     - Command: {oraql_command.commandLine(cmd)}\n'
                     f'     - {e!s}')
         return False
     logger.debug(f' Making {executable_path}')
     return True
 
-def copyExecutable(benchmark, version, seqfile=None):
+def copyExecutable(benchmark, version, seqs=None):
     executable_path = benchmark.executable
     if not os.path.isfile(executable_path):
         logger.debug(f'  Trying to keep executable as {version}, but {executable_path} did not exist.')
     else:
         shutil.copy(executable_path, f'{executable_path}.{version}')
         logger.debug(f'  Keeping {executable_path}.{version}')
-        if seqfile:
-            shutil.copy(seqfile, f'{executable_path}.{version}.sequence.txt')
+        if seqs:
+            oraql_seq.writeSeqFile(f'{executable_path}.{version}.sequence.txt', seqs)
     
 
 def runAndVerify(benchmark, io_pair):
@@ -165,15 +222,27 @@ def runAndVerify(benchmark, io_pair):
         cmd = benchmark.verify_cmd+io_pair.input
     else:
         cmd = [benchmark.executable]+io_pair.input
-    logger.debug(f'    - Run command "{" ".join(cmd)}"')
+    matcher = oraql_verify.outputMatcher(io_pair)
+
+    stream = oraql_verify.streamToCheck(io_pair, matcher)
     try:
-        run_result = sp.run(cmd, timeout=io_pair.timeout, stdout=PIPE, stderr=PIPE)
-    except sp.TimeoutExpired:
-        logger.debug(f'     - Run failed due to time out ({io_pair.timeout}s)')
-        return False
+        # the run slot decides the core set to run on
+        with oraql_parallel.stage('run'), oraql_events.phase('run'):
+            cmd, env, cpus = oraql_affinity.runSettings(benchmark, cmd)
+            logger.debug(f'    - Run command "{" ".join(cmd)}"')
+            run_result = oraql_verify.runProcess(cmd, io_pair.timeout, stream, matcher.checkLine,
+                                                 env=env, cpus=cpus)
     except Exception as e:
         logger.warn(f'     - Run failed due to unknown error:\n{e!s}')
         return False
+    if run_result.timed_out:
+        logger.debug(f'     - Run failed due to time out ({io_pair.timeout}s)')
+        return False
+    if run_result.aborted_at is not None:
+        logger.debug(f'     - Run aborted, line {run_result.aborted_at + 1} of '
+                     f'{stream} did not match expected pattern')
+        return False
+    oraql_events.exitCode('run', run_result.returncode)
 
     logger.debug(f'    - Check return value')
     if run_result.returncode is not io_pair.returncode:
@@ -183,8 +252,9 @@ def runAndVerify(benchmark, io_pair):
 
     logger.debug(f'    - Collect run output')
     run_output = ''
-    if os.path.isfile('output.txt'):
-        with open('output.txt', 'r') as fd:
+    output_file = io_pair.get('output_file', 'output.txt')
+    if os.path.isfile(output_file):
+        with open(output_file, 'r') as fd:
             run_output = fd.read()
     else:
         if io_pair.use_stdout:
@@ -193,153 +263,442 @@ def runAndVerify(benchmark, io_pair):
             run_output += run_result.stderr.decode('utf8')
 
     logger.debug(f'    - Try to match output with expected pattern')
-    expected_output = io_pair.output
-    if os.path.isfile(io_pair.output):
-        with open(io_pair.output, 'r') as fd:
-            expected_output = fd.read()
-
-    match = re.fullmatch(expected_output, run_output)
-    if match:
+    with oraql_events.phase('verify'):
+        matched = matcher.match(run_output)
+    if matched:
         logger.debug(f'    - Output matched expected pattern '
-                     f'{len(expected_output)} vs {len(run_output)}')
+                     f'{len(matcher.expected_output)} vs {len(run_output)}')
         return True
 
-    for pair in zip(expected_output.splitlines(), run_output.splitlines()):
-        match = re.fullmatch(*pair)
-        if not match:
-            logger.debug(f'    - Output "%s" did not match expected pattern "%s"'%(pair))
+    for pair in matcher.mismatches(run_output):
+        logger.debug(f'    - Output "%s" did not match expected pattern "%s"'%(pair))
     return False
 
-import hashlib
-def md5(fname):
-  hash_md5 = hashlib.md5()
-  with open(fname, "rb") as f:
-    for chunk in iter(lambda: f.read(4096), b""):
-      hash_md5.update(chunk)
-  return hash_md5.hexdigest()
-
+# Results of previously verified executables, see oraql_cache.ResultCache
 _seen_before = dict()
+# Frontend bitcode and other build products, see oraql_cache.BuildCache
+_build_cache = None
+# Function, line and pass of the queries, see oraql_provenance.ProvenanceIndex
+_provenance = None
+# Hash of the executable linked from objects, by oraql_cache.objectsFingerprint
+_linked = dict()
+
+@oraql_events.probe
 def compileAndRunOneConfiguration(benchmark, seqs, problemsizes, initialBuild = False):
     global _seen_before
     # compile individual files into object files
-    with tempfile.NamedTemporaryFile() as fp:
-      for source_file in benchmark.source_files:
-          logger.debug(f'- Compiling {source_file.path} with seq {str_BinListAsHex(seqs[source_file.path])}')
-          seqstr = " ".join([str(s) for s in seqs[source_file.path]])
-          options = source_file.options + benchmark.options
-          print(source_file.path)
-          print(seqstr)
-          cmd = " ".join(['-O3', '-aa-pipeline=optimistic-aa', '-stats', f'--opt-aa-seq="{seqstr}"'])
-          if(initialBuild):
-              cmd += ' -opt-aa-target="pessimisticAA"' # by supplying a target that does not exist, we disable optimism
-          fp.write(bytes(cmd, 'utf-8'))
-          fp.flush()
-          success, thisproblemsize = compileFile(benchmark, source_file, fp)
-          problemsizes[source_file.path] = max(thisproblemsize, problemsizes[source_file.path])
-          logger.debug(f'tmpfile content was: {cmd}')
-          if not success:
-              logger.info(f'Failed compilation with seq {str_BinListAsHex(seqs[source_file.path])}')
-              return False, problemsizes
-
-      # link object files into executable
-      success = linkExecutable(benchmark)
-      if not success:
-          logger.info(f'Failed linking with seq {seqs}')
-          return False, problemsizes
-      logger.debug(f'    Compiled. Compare executable file to previously seen files')
-      md5sum = md5(benchmark.executable)
-      if(md5sum in _seen_before):
-          if not _seen_before[md5sum]["res"]:
-              logger.debug(f'   We have seen this executable previously, and it was a failure.')
-              return False, _seen_before[md5sum]["problemsizes"]
-          else:
-              logger.debug(f'   We have seen this executable previously, and it was a success.')
-              copyExecutable(benchmark, 'final', fp.name)
-              return True, _seen_before[md5sum]["problemsizes"]
-      logger.debug(f'    This is a new executable, continue with verification.')
-
-      # run the generated executable for each input/output pair
-      for iop in benchmark.input_output_pairs:
-          success = runAndVerify(benchmark, iop)
-          if not success:
-              logger.debug(f'    unsuccessful execution.')
-              _seen_before[md5sum] = {"res": False, "problemsizes": problemsizes}
-              logger.info(f'Failed execution with seq {[(seq,str_BinListAsHex(seqs[seq])) for seq in seqs]}')
-              return False, problemsizes
-
-      # if we made it here, it means that all object files compiled, the
-      # executable linked and executed, and the results were correct for every
-      # input/output pair. Success!
-      logger.info(f'Successful test for all i/o pairs with seq {[(seq,str_BinListAsHex(seqs[seq])) for seq in seqs]}')
-      _seen_before[md5sum] = {"res": True, "problemsizes": problemsizes}
-      copyExecutable(benchmark, 'final', fp.name)
+    for source_file in benchmark.source_files:
+        logger.debug(f'- Compiling {source_file.path} with seq {seqs[source_file.path].hex()}')
+        seqstr = seqs[source_file.path].optAASeq()
+        print(source_file.path)
+        print(seqs[source_file.path].toRanges())
+        cmd = " ".join(['-O3', '-aa-pipeline=optimistic-aa', '-stats', f'--opt-aa-seq="{seqstr}"'])
+        only_functions = oraql_command.onlyFunctionsOption(source_file)
+        if only_functions:
+            cmd += f' {only_functions}'
+        if(initialBuild):
+            cmd += ' -opt-aa-target="pessimisticAA"' # by supplying a target that does not exist, we disable optimism
+            if oraql_settings.provenanceoption:
+                cmd += f' {oraql_settings.provenanceoption}'
+        with tempfile.NamedTemporaryFile() as seqfile:
+            seqfile.write(bytes(cmd, 'utf-8'))
+            seqfile.flush()
+            success, thisproblemsize = compileFile(benchmark, source_file, seqfile)
+        problemsizes[source_file.path] = max(thisproblemsize, problemsizes[source_file.path])
+        logger.debug(f'tmpfile content was: {cmd}')
+        if not success:
+            logger.info(f'Failed compilation with seq {seqs[source_file.path].hex()}')
+            return False, problemsizes
+
+    # link object files into executable
+    md5sum = oraql_cache.linkOrReuse(benchmark, objectFiles(benchmark), linkExecutable,
+                                     _linked, _seen_before, _build_cache)
+    if md5sum is None:
+        logger.info(f'Failed linking with seq {seqs}')
+        return False, problemsizes
+    logger.debug(f'    Compiled. Compare executable file to previously seen files')
+    seen = _seen_before.get(md5sum)
+    oraql_events.cacheLookup('result', seen is not None)
+    if seen is not None:
+        problemsizes = oraql_cache.mergeProblemSizes(problemsizes, seen["problemsizes"])
+        if not seen["res"]:
+            logger.debug(f'   We have seen this executable previously, and it was a failure.')
+            return False, problemsizes
+        else:
+            logger.debug(f'   We have seen this executable previously, and it was a success.')
+            copyExecutable(benchmark, 'final', seqs)
+            return True, problemsizes
+    logger.debug(f'    This is a new executable, continue with verification.')
+
+    # run the generated executable for each input/output pair
+    for iop in benchmark.input_output_pairs:
+        success = runAndVerify(benchmark, iop)
+        if not success:
+            logger.debug(f'    unsuccessful execution.')
+            _seen_before[md5sum] = {"res": False, "problemsizes": problemsizes}
+            logger.info(f'Failed execution with seq {[(seq,seqs[seq].hex()) for seq in seqs]}')
+            return False, problemsizes
+
+    # if we made it here, it means that all object files compiled, the
+    # executable linked and executed, and the results were correct for every
+    # input/output pair. Success!
+    logger.info(f'Successful test for all i/o pairs with seq {[(seq,seqs[seq].hex()) for seq in seqs]}')
+    _seen_before[md5sum] = {"res": True, "problemsizes": problemsizes}
+    _build_cache.store(md5sum, '.exe', benchmark.executable, [])
+    copyExecutable(benchmark, 'final', seqs)
     return True, problemsizes
 
-def compileAndRunAllConfigurations(benchmark, problemsizes):
-    seqs = {x.path:[0]*problemsizes[x.path] for x in benchmark.source_files}
-    for source_file in benchmark.source_files:
+def probeInScratch(benchmark, seqs, problemsizes, context):
+    '''
+    Run one probe inside a worker's scratch directory. On success the kept
+    executable and sequence are given a name unique to this probe, since
+    later (speculative) probes of the same worker overwrite the final version.
+    `context` describes the probe in the event log.
+    '''
+    oraql_events.setContext(**context)
+    success, _ = compileAndRunOneConfiguration(benchmark, seqs, problemsizes)
+    kept = None
+    if success:
+        tag = f'final.{os.getpid()}.{random.getrandbits(32):08x}'
+        kept = (os.path.abspath(f'{benchmark.executable}.{tag}'),
+                os.path.abspath(f'{benchmark.executable}.{tag}.sequence.txt'))
+        os.rename(f'{benchmark.executable}.final', kept[0])
+        os.rename(f'{benchmark.executable}.final.sequence.txt', kept[1])
+    # return the sizes of this probe, not the ones cached by the worker
+    return success, problemsizes, kept
+
+def probeRemotely(benchmark, seqs, problemsizes, context):
+    '''
+    probeInScratch for a worker on another node: the kept executable and
+    sequence are returned as contents, since the coordinator cannot read
+    the worker's files.
+    '''
+    success, problemsizes, kept = probeInScratch(benchmark, seqs, problemsizes, context)
+    if kept:
+        contents = []
+        for path in kept:
+            with open(path, 'rb') as fd:
+                contents.append(fd.read())
+            os.remove(path)
+        kept = tuple(contents)
+    return success, problemsizes, kept
+
+def commitProbe(benchmark, pool, kept):
+    executable_path = os.path.join(pool.base_path, benchmark.executable)
+    for source, target in zip(kept, [f'{executable_path}.final', f'{executable_path}.final.sequence.txt']):
+        if isinstance(source, bytes):
+            with open(f'{target}.tmp', 'wb') as fd:
+                fd.write(source)
+            os.replace(f'{target}.tmp', target)
+        else:
+            oraql_parallel.moveFile(source, target)
+    os.chmod(f'{executable_path}.final', 0o755)
+    logger.debug(f'  Keeping {benchmark.executable}.final')
+
+def dropProbe(kept):
+    # the files a successful probe kept in its scratch copy, once its result
+    # is no longer needed
+    for path in kept or ():
+        if isinstance(path, str) and os.path.isfile(path):
+            os.remove(path)
+
+def seqsKey(seqs):
+    return tuple(seqs.items())
+
+def withRange(seqs, path, start, end):
+    trial = dict(seqs)
+    trial[path] = seqs[path].setRange(start, end)
+    return trial
+
+def probeInPool(pool, benchmark, seqs, path, search, problemsizes):
+    '''
+    Probe the current range of `search` and keep the workers busy with the
+    ranges that are likely to follow. Results are consumed in serial order.
+    '''
+    ranges = search.upcoming(problemsizes[path], pool.jobs)
+    upcoming = [withRange(seqs, path, start, end) for start, end in ranges]
+    keys = [seqsKey(trial) for trial in upcoming]
+    args = [(benchmark, trial, dict(problemsizes), {'source': path, 'range': list(r)})
+            for trial, r in zip(upcoming, ranges)]
+    for _, _, kept in pool.discard(keep=keys):
+        dropProbe(kept)
+    pool.submit(keys[0], args[0], expected=keys[:1])
+    for key, probe_args in zip(keys[1:], args[1:]):
+        if not pool.submit(key, probe_args, expected=keys):
+            break
+    success, probesizes, kept = pool.result(keys[0], args[0])
+    for p in probesizes:
+        problemsizes[p] = max(problemsizes[p], probesizes[p])
+    if success:
+        commitProbe(benchmark, pool, kept)
+        # its files were moved, so the result cannot be committed again
+        pool.discard(keep=keys[1:])
+    return success, problemsizes
+
+def saveCheckpoint(checkpoint, benchmark, source_file, seqs, search, problemsizes):
+    '''
+    Write the search frontier to `checkpoint`: the sequences found so far,
+    the file being probed and the state of its search. A `search` of None
+    means probing of `source_file` has not started yet.
+    '''
+    state = {'source_files': [x.path for x in benchmark.source_files],
+             'source_file': source_file.path,
+             'seqs': {path: seq.toRanges() for path, seq in seqs.items()},
+             'search': search.state() if search else None,
+             'problemsizes': problemsizes}
+    with open(f'{checkpoint}.tmp', 'w') as fd:
+        json.dump(state, fd)
+    os.replace(f'{checkpoint}.tmp', checkpoint)
+
+def loadCheckpoint(checkpoint, benchmark):
+    if not os.path.isfile(checkpoint):
+        logger.info(f'- No checkpoint @ {checkpoint}, starting from scratch')
+        return None
+    try:
+        with open(checkpoint, 'r') as fd:
+            state = json.load(fd)
+    except Exception as e:
+        logger.warning(f'- Failed to read checkpoint @ {checkpoint}:\n{e}')
+        return None
+    if state['source_files'] != [x.path for x in benchmark.source_files]:
+        logger.warning(f'- Checkpoint @ {checkpoint} is for different source '
+                       f'files, starting from scratch')
+        return None
+    state['seqs'] = {path: oraql_seq.BitSeq.fromRanges(seq) for path, seq in state['seqs'].items()}
+    if state['search'] is not None:
+        state['search'] = oraql_search.Search.fromState(state['search'])
+    return state
+
+def compileAndRunAllConfigurations(benchmark, problemsizes, pool=None, checkpoint=None, resume=None, strategy='bisect', start=None):
+    seqs = start or {x.path:oraql_seq.BitSeq(problemsizes[x.path]) for x in benchmark.source_files}
+    source_files = benchmark.source_files
+    search = None
+    if resume:
+        seqs = resume['seqs']
+        search = resume['search']
+        paths = [x.path for x in source_files]
+        source_files = source_files[paths.index(resume['source_file']):]
+        logger.info(f'- Resuming at {resume["source_file"]}')
+    for source_file in source_files:
         logger.debug(f'Optimistic probing for {source_file.path}')
-        seqs, problemsizes = split_n_try(seqs, 0, -1, source_file, benchmark, problemsizes)
+        if search is None:
+            search = oraql_search.STRATEGIES[strategy](0, -1)
+        seqs, problemsizes = split_n_try(seqs, source_file, benchmark, problemsizes, search, pool, checkpoint)
+        search = None
     return seqs
 
-def split_n_try(seqs, start, orig_end, source_file, benchmark, problemsizes):
+def split_n_try(seqs, source_file, benchmark, problemsizes, search, pool=None, checkpoint=None):
   '''
-  Try if [start, end) is safe to add to the sequence. If yes, do so.
-  If no, bisect.
+  Try the ranges `search` proposes, adding those that are safe to the
+  sequence. With the default oraql_search.BisectSearch: if [start, end) is
+  safe, add it, if not, bisect. With a `checkpoint`, the search state is
+  saved after every probe so the search can be continued later.
   '''
-  end = orig_end
-  if(orig_end == -1):
-    end = problemsizes[source_file.path]
-  print(f"splitntry {start} {orig_end} {end}")
-  previous_seq = seqs[source_file.path]
-  success = False
-  seqs[source_file.path] = [1 if (i >= start and i < end) else seqs[source_file.path][i] for i in range(len(seqs[source_file.path]))]
-  success, problemsizes = compileAndRunOneConfiguration(benchmark, seqs, problemsizes)
-  if success:
-    return seqs, problemsizes
-  else:
-    seqs[source_file.path] = previous_seq
-    middle = start + (end - start) // 2
-    if(middle > start and middle < end):
-      left, problemsize_l = split_n_try(seqs, start, middle, source_file, benchmark, problemsizes)
-      right, problemsize_r = split_n_try(seqs, middle, orig_end, source_file, benchmark, problemsizes)
-      problemsizes[source_file.path] = max(problemsize_l[source_file.path], problemsize_r[source_file.path])
-      seqs[source_file.path] = [1 if left[source_file.path][i] == 1 else right[source_file.path][i] for i in range(len(seqs[source_file.path]))]
+  path = source_file.path
+  while True:
+    probe = search.next(problemsizes[path])
+    if probe is None:
+      break
+    start, end = probe
+    print(f"splitntry {start} {end}")
+    trial = withRange(seqs, path, start, end)
+    oraql_events.setContext(source=path, range=[start, end])
+    if pool is None:
+      success, problemsizes = compileAndRunOneConfiguration(benchmark, trial, problemsizes)
+    else:
+      success, problemsizes = probeInPool(pool, benchmark, seqs, path, search, problemsizes)
+    if success:
+      seqs = trial
+    search.report(success)
+    if checkpoint:
+      saveCheckpoint(checkpoint, benchmark, source_file, seqs, search, problemsizes)
   return seqs, problemsizes
 
-def runBenchmark(benchmark_file):
+def carryOver(benchmark, seq_file, problemsizes):
+    '''
+    The sequences of `seq_file`, found for earlier revisions of the source
+    files, translated to the current revisions with the provenance index.
+    Returns None if none of them could be translated.
+    '''
+    try:
+        old_seqs = oraql_seq.readSeqFile(seq_file, [x.path for x in benchmark.source_files])
+    except Exception as e:
+        logger.warning(f'- Failed to read sequence file @ {seq_file}:\n{e}')
+        return None
+    seqs = {x.path:oraql_seq.BitSeq(problemsizes[x.path]) for x in benchmark.source_files}
+    carried = False
+    source_files = {x.path: x for x in benchmark.source_files}
+    for path, old_seq in old_seqs.items():
+        if path not in seqs:
+            continue
+        revision = oraql_provenance.revision(benchmark, source_files[path])
+        if (path, revision) not in _provenance:
+            continue
+        # the revision the sequence was found for is the most recently
+        # indexed one of the same configuration with as many queries
+        old_revisions = [r for r, queries in _provenance.revisions(path)
+                         if r != revision and queries == len(old_seq)
+                         and oraql_provenance.sameConfiguration(r, revision)]
+        if len(old_seq) == problemsizes[path] and not old_revisions:
+            seqs[path] = oraql_seq.BitSeq(len(old_seq), old_seq.bits)
+        elif old_revisions:
+            seqs[path] = _provenance.carryOver(path, old_seq, old_revisions[0], revision, problemsizes[path])
+        else:
+            logger.info(f'- No indexed revision of {path} matches the sequence in {seq_file}')
+            continue
+        logger.info(f'- Carried over {seqs[path].count()} of {old_seq.count()} optimistic answers of {path}')
+        carried = True
+    return seqs if carried else None
+
+def runWorker(benchmark_file, address):
+    '''
+    Evaluate probes of `benchmark_file` for the coordinator at `address`,
+    an oraql_chunked started with --listen, see oraql_distributed.
+    '''
+    global _seen_before, _build_cache, _provenance
+    benchmark = readBenchmarkFile(benchmark_file)
+    _seen_before = oraql_cache.openResultCache(benchmark)
+    _build_cache = oraql_cache.openBuildCache()
+    _provenance = oraql_provenance.openProvenanceIndex()
+    oraql_command.configure(benchmark)
+    if not oraql_command.prepareLink(benchmark):
+        logger.error(f'Failed to build the prebuilt objects with {benchmark.link.prepare_cmd}')
+        return False
+    oraql_events.openEventLog(oraql_settings.eventlog, driver='chunked-worker',
+                              benchmark=benchmark.name)
+    core_sets = oraql_affinity.coreSets(benchmark, 1)
+    oraql_affinity.assignCpus(core_sets[0] if core_sets else None)
+    oraql_distributed.runWorker(address, probeRemotely)
+    return True
+
+def runBenchmark(benchmark_file, jobs=1, resume=False, strategy='bisect', carry_over=None, run_jobs=None, listen=None):
+    global _seen_before, _build_cache, _provenance
     benchmark = readBenchmarkFile(benchmark_file)
     logger.info(f'Start benchmark {benchmark.name}')
+    _seen_before = oraql_cache.openResultCache(benchmark)
+    _build_cache = oraql_cache.openBuildCache()
+    _provenance = oraql_provenance.openProvenanceIndex()
+    oraql_command.configure(benchmark)
+    if not oraql_command.prepareLink(benchmark):
+        logger.error(f'Failed to build the prebuilt objects with {benchmark.link.prepare_cmd}')
+        return False
     benchmark_path = os.path.dirname(benchmark_file)
+    checkpoint = f'{benchmark_file}.checkpoint'
+    oraql_events.openEventLog(oraql_settings.eventlog, driver='chunked',
+                              benchmark=benchmark.name)
+
+    # one core set per run that may happen at the same time; the driver only
+    # runs the benchmark while the probe pool is idle, so it can share the
+    # first set
+    stage_limits = dict(oraql_settings.stage_limits)
+    if run_jobs:
+        stage_limits['run'] = run_jobs
+    runs = min(jobs, stage_limits.get('run') or jobs)
+    core_sets = oraql_affinity.coreSets(benchmark, runs)
+    oraql_affinity.assignCpus(core_sets[0] if core_sets else None)
 
     success = False
-    seqs = {x.path:[] for x in benchmark.source_files}
+    seqs = {x.path:oraql_seq.BitSeq() for x in benchmark.source_files}
     problemsizes = {x.path:0 for x in benchmark.source_files}
-    success, problemsizes = compileAndRunOneConfiguration(benchmark, seqs, problemsizes, True)
+    state = loadCheckpoint(checkpoint, benchmark) if resume else None
+    if state:
+        # the initial build already succeeded in the interrupted run
+        success = True
+        problemsizes = state['problemsizes']
+    else:
+        oraql_events.setContext(initial=True)
+        success, problemsizes = compileAndRunOneConfiguration(benchmark, seqs, problemsizes, True)
     if success:
         logger.info(f'- Initial build successful, proceed to '
                     f'optimistic optimization for '
                     f'{len(benchmark.source_files)} source files')
-        copyExecutable(benchmark, 'initial')
+        if not state:
+            copyExecutable(benchmark, 'initial')
         print("RAN" + str(problemsizes))
-        seqs = compileAndRunAllConfigurations(benchmark, problemsizes)
+        start = None
+        if carry_over and not state:
+            start = carryOver(benchmark, carry_over, problemsizes)
+        if start:
+            oraql_events.setContext(carry_over=carry_over)
+            carried, problemsizes = compileAndRunOneConfiguration(benchmark, start, problemsizes)
+            if not carried:
+                logger.info(f'- The carried over sequences fail, starting from scratch')
+                start = None
+        pool = None
+        if listen:
+            pool = oraql_distributed.RemoteProbePool(oraql_distributed.parseAddress(listen))
+        elif jobs > 1:
+            logger.info(f'- Probing with {jobs} parallel jobs')
+            pool = oraql_parallel.ProbePool(jobs, probeInScratch, cpu_sets=core_sets,
+                                            stage_limits=stage_limits)
+        try:
+            seqs = compileAndRunAllConfigurations(benchmark, problemsizes, pool, checkpoint, state, strategy, start)
+        finally:
+            if pool is not None:
+                pool.close()
+        if os.path.isfile(checkpoint):
+            os.remove(checkpoint)
     else:
         logger.info(f'- Initial build of {benchmark.name} failed')
 
     logger.info(f'Finished benchmark {benchmark.name}, '
                 f'{"" if success else "un"}successful')
-    logger.info(f'Final sequence: {[(seq,str_BinListAsHex(seqs[seq])) for seq in seqs]}')
-
-benchmark_files = ['./benchmark.ot']
-
-if len(sys.argv) > 1:
-    benchmark_files = sys.argv[1:]
-
+    logger.info(f'Final sequence: {[(seq,seqs[seq].hex()) for seq in seqs]}')
+    for source_file in benchmark.source_files:
+        revision = oraql_provenance.revision(benchmark, source_file)
+        if success and (source_file.path, revision) in _provenance:
+            for line in oraql_provenance.describeUnsafe(_provenance, source_file.path, revision,
+                                                        seqs[source_file.path]):
+                logger.info(f'  Unsafe: {line}')
+    return success
+
+parser = argparse.ArgumentParser(description='Find the optimistic alias '
+                                 'analysis answers that are safe to use.')
+parser.add_argument('benchmark_files', nargs='*', default=['./benchmark.ot'])
+parser.add_argument('-j', '--jobs', type=int, default=1,
+                    help='number of probes to evaluate at the same time, '
+                         'each in its own copy of the benchmark directory')
+parser.add_argument('--run-jobs', type=int,
+                    help='number of benchmark runs at the same time, fewer '
+                         'than --jobs to compile the probes that follow '
+                         'while the current one runs')
+parser.add_argument('--listen', metavar='HOST:PORT',
+                    help='hand the probes to workers on other nodes that '
+                         'connect to this address, see --worker; they '
+                         'authenticate with ORAQL_AUTHKEY, or the key file '
+                         'of oraql_settings, which is created if missing')
+parser.add_argument('--worker', metavar='HOST:PORT',
+                    help='evaluate probes for the coordinator listening at '
+                         'this address instead of searching')
+parser.add_argument('--resume', action='store_true',
+                    help='continue the search from the checkpoint written '
+                         'by an interrupted run')
+parser.add_argument('--search', choices=sorted(oraql_search.STRATEGIES),
+                    default='bisect',
+                    help='strategy to pick the ranges of queries to probe: '
+                         'bisection or adaptive group testing, which needs '
+                         'fewer probes when there are many unsafe queries')
+parser.add_argument('--carry-over', metavar='SEQ_FILE',
+                    help='start from the sequences found for an earlier '
+                         'revision of the source files, e.g. a '
+                         '.final.sequence.txt, translated to the current '
+                         'revision with the provenance index')
+args = parser.parse_args()
+
+# exit nonzero if any search failed, e.g. for oraql_batch
+failed = False
 base_path = os.path.abspath(os.curdir)
-for benchmark_file in benchmark_files:
+for benchmark_file in args.benchmark_files:
     os.chdir(base_path)
     try:
-        runBenchmark(benchmark_file)
+        if args.worker:
+            success = runWorker(benchmark_file, oraql_distributed.parseAddress(args.worker))
+        else:
+            success = runBenchmark(benchmark_file, args.jobs, args.resume, args.search,
+                                   args.carry_over, args.run_jobs, args.listen)
+        failed = failed or not success
     except Exception as e:
+        failed = True
         logger.error(f' The execution of {benchmark_file} ended in an '
                      f' uncaught exception:\n{e!s}', exc_info=True)
+sys.exit(1 if failed else 0)
@@ -0,0 +1,133 @@
+import os
+import shlex
+import subprocess as sp
+
+import oraql_settings
+
+# Whether commands go through /bin/sh, see configure
+_shell = False
+
+def configure(benchmark):
+    '''
+    Run the commands of `benchmark` directly, or through /bin/sh if its
+    benchmark file asks for "shell": true, so that variables, globs and
+    command substitutions in its options and make command are expanded.
+    '''
+    global _shell
+    _shell = "shell" in benchmark and bool(benchmark.shell)
+
+def splitCommand(cmd):
+    '''
+    The argument vector of a command from a benchmark file, given either as
+    a list or as a string that is split like a shell would, but without any
+    expansion.
+    '''
+    if isinstance(cmd, str):
+        return shlex.split(cmd)
+    return [str(arg) for arg in cmd]
+
+def compilerOptions(options):
+    '''
+    The arguments of the "options" of a benchmark file. Each option string
+    is split like a shell would, so that stray whitespace, e.g. in
+    " -D__TEST_MG_CONVERGENCE", and several options in one string still
+    work without a shell.
+    '''
+    return [arg for option in options for arg in splitCommand(option)]
+
+def commandLine(cmd):
+    '''
+    `cmd` for log messages, quoted so that it can be pasted into a shell.
+    '''
+    if isinstance(cmd, str):
+        return cmd
+    return shlex.join(cmd)
+
+def run(cmd, **kwargs):
+    '''
+    subprocess.run for `cmd`, an argument vector or a command string as in
+    the benchmark file. Without a shell, the command is executed directly.
+    With one, an argument vector is joined with spaces, unquoted, as the
+    drivers used to build their command lines.
+    '''
+    if _shell:
+        return sp.run(cmd if isinstance(cmd, str) else " ".join(cmd), shell=True, **kwargs)
+    return sp.run(splitCommand(cmd), **kwargs)
+
+def linkCommand(benchmark, objects):
+    '''
+    The argument vector of the "command" in the "link" section of
+    `benchmark`, linking `objects` into the executable. Its "{objects}" and
+    "{executable}" arguments are replaced by the object files and the
+    executable; without them, the objects and "-o executable" are appended.
+    '''
+    cmd = splitCommand(benchmark.link.command)
+    if '{objects}' not in cmd and '{executable}' not in cmd:
+        cmd += ['{objects}', '-o', '{executable}']
+    argv = []
+    for arg in cmd:
+        if arg == '{objects}':
+            argv += objects
+        else:
+            argv.append(arg.replace('{executable}', benchmark.executable))
+    return argv
+
+def linkObjects(benchmark, source_objects):
+    '''
+    Objects to link directly: `source_objects`, those of the source files
+    the search compiles, followed by the prebuilt "objects" of the "link"
+    section. Returns None if some are missing, so that make is used instead.
+    '''
+    objects = list(source_objects) + list(benchmark.link.get('objects', []))
+    if not all(os.path.isfile(o) for o in objects):
+        return None
+    return objects
+
+def buildCommand(benchmark, source_objects):
+    '''
+    The command that builds the executable from the objects of the source
+    files: a direct link if the benchmark has a "link" section and all
+    objects exist, its make command otherwise.
+    '''
+    if "link" in benchmark:
+        objects = linkObjects(benchmark, source_objects)
+        if objects is not None:
+            return linkCommand(benchmark, objects)
+    return benchmark.make_cmd
+
+def prepareLink(benchmark):
+    '''
+    Run the "prepare_cmd" of the "link" section, which builds the prebuilt
+    objects once before the search. Returns False if it failed.
+    '''
+    if "link" not in benchmark or "prepare_cmd" not in benchmark.link:
+        return True
+    try:
+        return run(benchmark.link.prepare_cmd, stdout=sp.DEVNULL, stderr=sp.DEVNULL).returncode == 0
+    except OSError:
+        return False
+
+def sourceCompiler(benchmark, source_file):
+    '''
+    The compiler of `source_file`: the "compiler" of the benchmark file, or
+    the one oraql_settings names for its language.
+    '''
+    if "compiler" in benchmark:
+        return benchmark.compiler
+    if source_file.path.endswith(('.cc', '.cpp', '.cu')):
+        return oraql_settings.clangppcommand
+    if source_file.path.endswith(('.f90', '.F90')):
+        return oraql_settings.flangcommand
+    return oraql_settings.clangcommand
+
+def onlyFunctionsOption(source_file):
+    '''
+    The option restricting the optimistic queries of `source_file` to its
+    "only_functions", or None if it has none or oraql_settings has no such
+    option, and all functions are searched.
+    '''
+    if not oraql_settings.onlyfunctionsoption:
+        return None
+    if "only_functions" not in source_file or not source_file.only_functions:
+        return None
+    return f'{oraql_settings.onlyfunctionsoption}={",".join(source_file.only_functions)}'
@@ -0,0 +1,273 @@
+import os
+import time
+import queue
+import struct
+import socket
+import shutil
+import logging
+import secrets
+import threading
+import traceback
+from multiprocessing.connection import Listener, Client, wait
+from multiprocessing.connection import deliver_challenge, answer_challenge
+
+import oraql_settings
+import oraql_parallel
+
+logger = logging.getLogger('')
+
+def parseAddress(text):
+    '''
+    (host, port) of "host:port". An empty host listens on all interfaces.
+    '''
+    host, port = text.rsplit(':', 1)
+    return host, int(port)
+
+def authKey(create=False):
+    '''
+    The key peers authenticate with: ORAQL_AUTHKEY, else the contents of
+    oraql_settings.distributed_authkey_file. Probes are exchanged as
+    pickles, so there is no default key. With `create`, as the coordinator
+    does, a random key is written to the file if it does not exist yet.
+    '''
+    key = os.environ.get('ORAQL_AUTHKEY')
+    if key:
+        return key.encode()
+    path = os.path.expanduser(oraql_settings.distributed_authkey_file)
+    if create and not os.path.exists(path):
+        tmp = f'{path}.{os.getpid()}.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32) + '\n')
+        try:
+            # never replaces the key of a coordinator that was faster
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+    try:
+        with open(path, 'rb') as fd:
+            if os.fstat(fd.fileno()).st_mode & 0o077:
+                raise RuntimeError(f'{path} must only be readable by its owner')
+            key = fd.read().strip()
+    except FileNotFoundError:
+        key = None
+    if not key:
+        raise RuntimeError(f'No key to authenticate probe workers with, set '
+                           f'ORAQL_AUTHKEY or start the coordinator to create {path}')
+    return key
+
+def _receiveTimeout(conn, seconds):
+    # a peer that stops sending makes recv fail instead of blocking forever
+    sock = socket.socket(fileno=os.dup(conn.fileno()))
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO,
+                        struct.pack('ll', int(seconds), int(seconds % 1 * 1e6)))
+    finally:
+        sock.close()
+
+def _keepAlive(conn):
+    # notice workers whose node went away without closing the connection
+    sock = socket.socket(fileno=os.dup(conn.fileno()))
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in [('TCP_KEEPIDLE', 60), ('TCP_KEEPINTVL', 10), ('TCP_KEEPCNT', 6)]:
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+    finally:
+        sock.close()
+
+class _RemoteSlot:
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.key = None
+
+class RemoteProbePool:
+    '''
+    Pool of probe workers on other nodes, with the interface of
+    oraql_parallel.ProbePool. The coordinator listens on `address` and
+    workers started with runWorker connect to it, at any time during the
+    search. Every worker evaluates one probe at a time in a scratch copy of
+    its benchmark directory.
+
+    A probe whose worker is lost, because it exited or its connection
+    broke, is handed to another worker when its result is needed, at most
+    oraql_settings.distributed_retries times. Unlike local workers, remote
+    ones cannot be preempted: a speculative probe that is no longer needed
+    runs to the end and its result is discarded.
+    '''
+    def __init__(self, address, base_path=None):
+        self.base_path = os.path.abspath(base_path or os.curdir)
+        self.authkey = authKey(create=True)
+        # peers authenticate on a thread of their own, see _admitPeer
+        self.listener = Listener(address)
+        self.slots = []
+        self.results = dict()
+        self.attempts = dict()
+        self._joined = queue.Queue()
+        self._closed = False
+        threading.Thread(target=self._acceptLoop, daemon=True).start()
+        logger.info(f'- Waiting for probe workers on {self.listener.address[0]}:{self.listener.address[1]}')
+
+    def _acceptLoop(self):
+        while not self._closed:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                # the listener was closed
+                continue
+            threading.Thread(target=self._admitPeer, args=(conn,), daemon=True).start()
+
+    def _admitPeer(self, conn):
+        # a peer that does not authenticate and send its name in time is
+        # dropped, without holding up the others
+        try:
+            _receiveTimeout(conn, oraql_settings.distributed_handshake_timeout)
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+            name = conn.recv()
+            _receiveTimeout(conn, 0)
+        except Exception:
+            # a peer with the wrong key, or one that timed out
+            conn.close()
+            return
+        _keepAlive(conn)
+        self._joined.put(_RemoteSlot(conn, name))
+
+    @property
+    def jobs(self):
+        return max(1, len(self.slots))
+
+    def _admit(self, block=False):
+        if block:
+            self._addSlot(self._joined.get())
+        while True:
+            try:
+                self._addSlot(self._joined.get_nowait())
+            except queue.Empty:
+                return
+
+    def _addSlot(self, slot):
+        logger.info(f'- Probe worker {slot.name} joined')
+        self.slots.append(slot)
+
+    def _lost(self, slot):
+        logger.warning(f'- Lost probe worker {slot.name}')
+        self.slots.remove(slot)
+        slot.conn.close()
+        if slot.key is not None:
+            self.attempts[slot.key] = self.attempts.get(slot.key, 0) + 1
+            if self.attempts[slot.key] > oraql_settings.distributed_retries:
+                raise RuntimeError(f'Probe lost with {self.attempts[slot.key]} workers, giving up')
+
+    def _running(self, key):
+        return any(slot.key == key for slot in self.slots)
+
+    def submit(self, key, args, expected=()):
+        '''
+        Start the probe `key` unless it is already running or done. Returns
+        False if every worker is busy.
+        '''
+        if key in self.results or self._running(key):
+            return True
+        self._admit()
+        for slot in [slot for slot in self.slots if slot.key is None]:
+            try:
+                slot.conn.send((key, args))
+            except OSError:
+                self._lost(slot)
+                continue
+            slot.key = key
+            return True
+        return False
+
+    def _collect(self):
+        self._admit()
+        busy = {slot.conn: slot for slot in self.slots if slot.key is not None}
+        if not busy:
+            # nothing can finish before another worker joins
+            self._admit(block=True)
+            return
+        for conn in wait(list(busy), timeout=1):
+            slot = busy[conn]
+            try:
+                key, ok, result = conn.recv()
+            except (EOFError, OSError):
+                self._lost(slot)
+                continue
+            slot.key = None
+            if not ok:
+                raise RuntimeError(f'Probe failed in worker {slot.name}:\n{result}')
+            self.results[key] = result
+
+    def result(self, key, args, expected=()):
+        self.submit(key, args, expected=(key, *expected))
+        while key not in self.results:
+            # the worker of the probe may have been lost
+            if not self._running(key):
+                self.submit(key, args)
+            self._collect()
+        return self.results[key]
+
+    def discard(self, keep=()):
+        return [self.results.pop(k) for k in list(self.results) if k not in keep]
+
+    def close(self):
+        self._closed = True
+        self._admit()
+        for slot in self.slots:
+            try:
+                if slot.key is None:
+                    slot.conn.send(None)
+            except OSError:
+                pass
+            slot.conn.close()
+        self.listener.close()
+
+def _connect(address):
+    deadline = time.monotonic() + oraql_settings.distributed_connect_timeout
+    while True:
+        try:
+            return Client(address, authkey=authKey())
+        except (ConnectionRefusedError, FileNotFoundError, socket.gaierror):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(1)
+
+def runWorker(address, probe_fn, base_path=None):
+    '''
+    Evaluate probes for the coordinator at `address` until it closes the
+    connection. Probes are built and run in a scratch copy of `base_path`,
+    so several workers may share a benchmark directory.
+    '''
+    conn = _connect(address)
+    name = f'{socket.gethostname()}:{os.getpid()}'
+    base_path = os.path.abspath(base_path or os.curdir)
+    scratch_root = oraql_parallel.makeScratchRoot('oraql-worker-')
+    os.chdir(oraql_parallel.makeScratchCopy(base_path, scratch_root))
+    logger.info(f'Probe worker {name} connected to {address[0]}:{address[1]}')
+    conn.send(name)
+    try:
+        while True:
+            try:
+                task = conn.recv()
+            except (EOFError, OSError):
+                break
+            if task is None:
+                break
+            key, args = task
+            try:
+                reply = (key, True, probe_fn(*args))
+            except Exception:
+                reply = (key, False, traceback.format_exc())
+            try:
+                conn.send(reply)
+            except OSError:
+                break
+    finally:
+        conn.close()
+        os.chdir(base_path)
+        shutil.rmtree(scratch_root, ignore_errors=True)
+    logger.info(f'Probe worker {name} finished')
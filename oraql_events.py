@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import functools
+import contextlib
+
+# Where probe records are appended, None if no log is written
+_log_path = None
+# Fields added to every record, e.g. the driver and benchmark name
+_base_fields = dict()
+# Fields describing the probe about to run, e.g. the range being tested
+_context = dict()
+# Record of the probe that is running
+_probe = None
+
+def openEventLog(path, **fields):
+    '''
+    Append a JSON record for every probe to `path`, or stop logging if
+    `path` is None. `fields` are added to all records.
+    '''
+    global _log_path, _base_fields
+    _log_path = os.path.abspath(path) if path else None
+    _base_fields = fields
+
+def setContext(**fields):
+    '''
+    Describe the next probe, e.g. with the source file and range tested.
+    '''
+    global _context
+    _context = fields
+
+def seqsHash(seqs):
+    return hashlib.sha1(repr(sorted(seqs.items())).encode()).hexdigest()[:16]
+
+def probe(fn):
+    '''
+    Decorator for the function that builds and runs one configuration,
+    called with the benchmark and the sequences and returning success first.
+    Every call is logged as one probe record.
+    '''
+    @functools.wraps(fn)
+    def wrapper(benchmark, seqs, *args, **kwargs):
+        global _probe
+        _probe = {**_base_fields, **_context, 'seqs': seqsHash(seqs),
+                  'pid': os.getpid(), 'start': time.time(), 'phases': dict(),
+                  'cache': dict(), 'exit_codes': dict(), 'stage': None}
+        start = time.perf_counter()
+        result = None
+        try:
+            result = fn(benchmark, seqs, *args, **kwargs)
+            return result
+        finally:
+            record, _probe = _probe, None
+            record['duration'] = time.perf_counter() - start
+            record['success'] = bool(result and result[0])
+            _write(record)
+    return wrapper
+
+def _write(record):
+    if _log_path is None:
+        return
+    # a single write per record, so records of concurrent workers do not
+    # interleave
+    with open(_log_path, 'a') as fd:
+        fd.write(json.dumps(record) + '\n')
+
+@contextlib.contextmanager
+def phase(name):
+    '''
+    Add the time spent in the block to phase `name` of the running probe.
+    The last phase entered is recorded as the stage the probe got to.
+    '''
+    start = time.perf_counter()
+    if _probe is not None:
+        _probe['stage'] = name
+    try:
+        yield
+    finally:
+        if _probe is not None:
+            phases = _probe['phases']
+            phases[name] = phases.get(name, 0) + time.perf_counter() - start
+
+def cacheLookup(name, hit):
+    '''
+    Count a hit or miss in the cache `name` for the running probe.
+    '''
+    if _probe is None:
+        return
+    counts = _probe['cache'].setdefault(name, {'hits': 0, 'misses': 0})
+    counts['hits' if hit else 'misses'] += 1
+    if hit and name == 'result':
+        _probe['stage'] = 'result cache'
+
+def exitCode(name, code):
+    if _probe is not None:
+        _probe['exit_codes'].setdefault(name, []).append(code)
+
+def readEventLog(path):
+    with open(path, 'r') as fd:
+        return [json.loads(line) for line in fd if line.strip()]
+
+def summarize(records, slowest=10, out=sys.stdout):
+    '''
+    Print the time spent per phase, the cache hit rates and the slowest
+    probes of an event log.
+    '''
+    total = sum(r['duration'] for r in records)
+    passed = sum(1 for r in records if r['success'])
+    print(f'{len(records)} probes, {passed} successful, {total:.1f}s', file=out)
+
+    phases = dict()
+    for r in records:
+        for name, seconds in r['phases'].items():
+            count, spent = phases.get(name, (0, 0))
+            phases[name] = (count + 1, spent + seconds)
+    print(f'\n{"phase":<16}{"probes":>8}{"seconds":>12}{"share":>8}', file=out)
+    for name, (count, spent) in sorted(phases.items(), key=lambda p: -p[1][1]):
+        share = 100 * spent / total if total else 0
+        print(f'{name:<16}{count:>8}{spent:>12.1f}{share:>7.1f}%', file=out)
+    other = total - sum(spent for _, spent in phases.values())
+    print(f'{"(other)":<16}{"":>8}{other:>12.1f}', file=out)
+
+    caches = dict()
+    for r in records:
+        for name, counts in r['cache'].items():
+            hits, lookups = caches.get(name, (0, 0))
+            caches[name] = (hits + counts['hits'],
+                            lookups + counts['hits'] + counts['misses'])
+    if caches:
+        print(f'\n{"cache":<16}{"lookups":>8}{"hit rate":>12}', file=out)
+        for name, (hits, lookups) in sorted(caches.items()):
+            print(f'{name:<16}{lookups:>8}{100 * hits / lookups:>11.1f}%', file=out)
+
+    print(f'\nslowest probes:', file=out)
+    for r in sorted(records, key=lambda r: -r['duration'])[:slowest]:
+        where = f'{r.get("source", "")} {r.get("range", r.get("pair", ""))}'.strip()
+        phases = ", ".join(f'{name} {seconds:.1f}s' for name, seconds in
+                           sorted(r['phases'].items(), key=lambda p: -p[1]))
+        print(f'{r["duration"]:>9.1f}s {"pass" if r["success"] else "fail"} '
+              f'{r["seqs"]} {where} ({phases})', file=out)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize the probe event '
+                                     'log written by the oraql drivers.')
+    parser.add_argument('event_log', nargs='?', default='oraql-events.jsonl')
+    parser.add_argument('-n', '--slowest', type=int, default=10,
+                        help='number of slowest probes to list')
+    args = parser.parse_args()
+    summarize(readEventLog(args.event_log), args.slowest)
@@ -0,0 +1,98 @@
+import os
+import sys
+import mmap
+import struct
+import hashlib
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Section flags and types of the ELF format
+SHF_ALLOC = 0x2
+SHT_NOTE = 7
+SHT_NOBITS = 8
+ET_EXEC = 2
+ET_DYN = 3
+
+# Layout of the ELF header and of a section header, by ELF class
+_HEADER = {1: '16sHHIIIIIHHHHHH', 2: '16sHHIQQQIHHHHHH'}
+_SECTION = {1: 'IIIIIIIIII', 2: 'IIQQQQIIQQ'}
+
+def _hasher():
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+def _loadedSections(data):
+    '''
+    The type, machine and entry point of the ELF executable or shared
+    library `data`, and (name, type, flags, address, size, offset) of its
+    sections that are loaded into memory, except notes, whose build ID
+    changes with everything else in the file. Returns None if `data` is not
+    such a file. Addresses are kept as they are: whether a build ID note
+    exists at all moves the sections after it, and with them the addresses
+    stored in their contents.
+    '''
+    if len(data) < 16 or data[:4] != b'\x7fELF' or data[4] not in _HEADER or data[5] not in (1, 2):
+        return None
+    order = '<' if data[5] == 1 else '>'
+    header = struct.Struct(order + _HEADER[data[4]])
+    section = struct.Struct(order + _SECTION[data[4]])
+    if len(data) < header.size:
+        return None
+    (_, e_type, e_machine, _, e_entry, _, shoff, _, _, _, _,
+     shentsize, shnum, shstrndx) = header.unpack_from(data)
+    # relocatable objects keep what they mean in non-loaded sections
+    if e_type not in (ET_EXEC, ET_DYN) or shnum == 0 or shentsize != section.size:
+        return None
+    if shoff + shnum * shentsize > len(data) or shstrndx >= shnum:
+        return None
+    headers = [section.unpack_from(data, shoff + i * shentsize) for i in range(shnum)]
+    names_offset = headers[shstrndx][4]
+    sections = []
+    for name, sh_type, flags, addr, offset, size, _, _, _, _ in headers:
+        if not flags & SHF_ALLOC or sh_type == SHT_NOTE:
+            continue
+        end = data.find(b'\0', names_offset + name)
+        section_name = bytes(data[names_offset + name:end])
+        # sections without contents in the file only have a size
+        sections.append((section_name, sh_type, flags, addr, size,
+                         None if sh_type == SHT_NOBITS else offset))
+    return (e_type, e_machine, e_entry), sections
+
+def executableFingerprint(path):
+    '''
+    Hash of what an executable does when run: the sections of an ELF file
+    that are loaded into memory, so that debug information and the value of
+    the build ID and other notes do not matter. Linking with or without a
+    build ID changes the layout of the sections, and so the hash. Other
+    files, e.g. scripts, are hashed as a whole. The file is mapped rather
+    than read, and hashed with XXH3 if the xxhash module is available,
+    BLAKE2 otherwise.
+    '''
+    digest = _hasher()
+    with open(path, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            loaded = _loadedSections(data)
+            if loaded is None:
+                digest.update(data)
+                return digest.hexdigest()
+            header, sections = loaded
+            digest.update(struct.pack('<HHQ', *header))
+            # hash the sections in place, views must be released before the
+            # mapping is closed
+            with memoryview(data) as view:
+                for name, sh_type, flags, addr, size, offset in sections:
+                    digest.update(struct.pack('<IQQQ', sh_type, flags, addr, size) + name + b'\0')
+                    if offset is not None:
+                        with view[offset:offset + size] as contents:
+                            digest.update(contents)
+    return digest.hexdigest()
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        print(f'{executableFingerprint(path)}  {path}')
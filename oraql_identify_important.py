@@ -1,11 +1,21 @@
 import json
 import dotmap
 import oraql_settings
+import oraql_cache
+import oraql_seq
+import oraql_verify
+import oraql_affinity
+import oraql_events
+import oraql_command
+import oraql_timing
+import oraql_provenance
+import oraql_profile
 import sys
 import os
 import time as TIME
 from timeit import timeit
 import shutil
+import socket
 import logging as log
 import subprocess as sp
 import tempfile
@@ -57,14 +67,6 @@ ch.setLevel(log.DEBUG if DEBUG_CONSOLE else log.INFO)
 ch.setFormatter(formatter)
 logger.addHandler(ch)
 
-def str_BinListAsHex(l):
-    # pad list so it has at least length 1
-    l = [1] + l
-    # interpret input list `l` as bits in a binary number
-    num = int("".join([str(x) for x in l]), 2)
-    # return as hex string
-    return format(num, 'x')
-
 def readBenchmarkFile(benchmark_file):
     if not os.path.isfile(benchmark_file):
         logger.error(f'Benchmark file @ {benchmark_file} does not exist')
@@ -82,8 +84,25 @@ def compileFile(benchmark, source_file, seqfile):
     compiler = oraql_settings.clangcommand
     if source_file.path.endswith('.cc') or source_file.path.endswith('.cpp') or source_file.path.endswith('.cu'):
         compiler =  oraql_settings.clangppcommand
+    # reuse the object file if this file was compiled with the same sequence
+    # before
+    with open(seqfile.name, 'r') as fd:
+        cmd = fd.read()
+    options = oraql_command.compilerOptions(source_file.options + benchmark.options)
+    o_outfile = oraql_cache.objectPath(options, source_file.path)
+    key = oraql_cache.commandKey([compiler], cmd, source_file.path)
+    reused, problemsize = _build_cache.restore(key, '.o', o_outfile)
+    oraql_events.cacheLookup('object', reused)
+    if reused:
+        logger.debug(f'  Reusing object file of {source_file.path}')
+        return True, problemsize
+    depfile = o_outfile + '.d'
+    dep_options = oraql_cache.depfileOptions(source_file.path, depfile)
     try:
-        run_result = sp.run(f'{compiler} @{seqfile.name} {source_file.path}', shell=True, stdout=PIPE, stderr=PIPE)
+        with oraql_events.phase('compile'):
+            run_result = oraql_command.run([*oraql_command.splitCommand(compiler), f'@{seqfile.name}',
+                                            *dep_options, source_file.path], stdout=PIPE, stderr=PIPE)
+        oraql_events.exitCode('compile', run_result.returncode)
 
         if run_result.returncode is not 0:
             logger.debug(f'   - Compile error, exit code was {run_result.returncode} and command was:\n{compiler} @{seqfile.name} {source_file.path}')
@@ -113,8 +132,13 @@ def compileFile(benchmark, source_file, seqfile):
     except Exception as e:
         logger.warning(f'Did not find optimistic AA statistics in compiler stderr. Did you build LLVM with OptimisticAA support?')
         return False, 0
+    _build_cache.store(key, '.o', o_outfile, oraql_cache.readDeps(source_file.path, depfile), problemsize)
     return True, problemsize
 
+def objectFiles(benchmark):
+    return [oraql_cache.objectPath(oraql_command.compilerOptions(sf.options + benchmark.options), sf.path)
+            for sf in benchmark.source_files]
+
 def linkExecutable(benchmark):
     executable_path = benchmark.executable
     if os.path.isfile(executable_path):
@@ -122,23 +146,25 @@ def linkExecutable(benchmark):
         os.remove(executable_path)
 
     try:
-        cmd = [benchmark.make_cmd]
-        print(cmd)
-        run_result = sp.run(cmd, stdout=sp.DEVNULL, stderr=sp.DEVNULL, shell=True)
+        cmd = oraql_command.buildCommand(benchmark, objectFiles(benchmark))
+        logger.debug(f'  Link with {oraql_command.commandLine(cmd)}')
+        with oraql_events.phase('link'):
+            run_result = oraql_command.run(cmd, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+        oraql_events.exitCode('link', run_result.returncode)
         if run_result.returncode is not 0:
             logger.warn(f'   - Make command error, exit code was '
                         f'{run_result.returncode}:\n'
-                        f'     - Command: {" ".join(cmd)}')
+                        f'     - Command: {oraql_command.commandLine(cmd)}')
             return False
     except Exception as e:
         logger.warn(f'   - Make command error:\n'
-                    f'     - Command: {" ".join(cmd)}\n'
+                    f'     - Command: {oraql_command.commandLine(cmd)}\n'
                     f'     - {e!s}')
         return False
     logger.debug(f' Making {executable_path}')
     return True
 
-def copyExecutable(executable_path, version, seqfile=None):
+def copyExecutable(executable_path, version, seqfile=None, seqs=None):
     if not os.path.isfile(executable_path):
         logger.debug(f'  Trying to keep executable as {version}, but {executable_path} did not exist.')
     else:
@@ -146,41 +172,55 @@ def copyExecutable(executable_path, version, seqfile=None):
         logger.debug(f'  Keeping {executable_path}.{version}')
         if seqfile:
             shutil.copy(seqfile, f'{executable_path}.{version}.sequence.txt')
+        if seqs:
+            oraql_seq.writeSeqFile(f'{executable_path}.{version}.sequence.txt', seqs)
 
 
 def runAndVerify(benchmark, io_pair):
+    '''
+    Run and verify `io_pair`. Returns success, the oraql_verify.RunTimes of
+    the run and, if collected, its hardware counters.
+    '''
     time = None
-    if "time_cmd" in dir(benchmark):
+    counters = None
+    if "time_cmd" in benchmark:
         cmd = [benchmark.time_cmd, benchmark.executable]+io_pair.input
     else:
-        cmd = [os.path.join(os.path.dirname(sys.argv[0]), "oraql-time"), benchmark.executable]+io_pair.input
+        cmd = [benchmark.executable]+io_pair.input
     print(cmd)
 
-    time_path = "time.out"
-    if os.path.isfile(time_path):
-        logger.debug(f'  Delete existing executable @ {time_path}')
-        os.remove(time_path)
+    matcher = oraql_verify.outputMatcher(io_pair)
 
+    cmd, env, cpus = oraql_affinity.runSettings(benchmark, cmd)
     logger.debug(f'    - Run command "{" ".join(cmd)}"')
+    stream = oraql_verify.streamToCheck(io_pair, matcher)
     try:
-        run_result = sp.run(cmd, timeout=io_pair.timeout, stdout=PIPE, stderr=PIPE)
-    except sp.TimeoutExpired:
-        logger.debug(f'     - Run failed due to time out ({io_pair.timeout}s)')
-        return False, time
+        with oraql_events.phase('run'):
+            run_result = oraql_verify.runProcess(cmd, io_pair.timeout, stream, matcher.checkLine,
+                                                 counters=collectCounters(), env=env, cpus=cpus)
     except Exception as e:
         logger.warn(f'     - Run failed due to unknown error:\n{e!s}')
-        return False, time
+        return False, time, counters
+    if run_result.timed_out:
+        logger.debug(f'     - Run failed due to time out ({io_pair.timeout}s)')
+        return False, time, counters
+    if run_result.aborted_at is not None:
+        logger.debug(f'     - Run aborted, line {run_result.aborted_at + 1} of '
+                     f'{stream} did not match expected pattern')
+        return False, time, counters
+    oraql_events.exitCode('run', run_result.returncode)
 
     logger.debug(f'    - Check return value')
     if run_result.returncode is not io_pair.returncode:
         logger.debug(f'  Run failed due to exit code mismatch, expected '
                      f'{io_pair.returncode} got {run_result.returncode}')
-        return False, time
+        return False, time, counters
 
     logger.debug(f'    - Collect run output')
     run_output = ''
-    if os.path.isfile('output.txt'):
-        with open('output.txt', 'r') as fd:
+    output_file = io_pair.get('output_file', 'output.txt')
+    if os.path.isfile(output_file):
+        with open(output_file, 'r') as fd:
             run_output = fd.read()
     else:
         if io_pair.use_stdout:
@@ -188,62 +228,117 @@ def runAndVerify(benchmark, io_pair):
         if io_pair.use_stderr:
             run_output += run_result.stderr.decode('utf8')
 
-    if not os.path.isfile(time_path):
-        logger.debug(f'  No time file, expected "{time_path}"')
-        return False, time
-
-    with open(time_path, 'r') as fd:
-        try:
-            first_line = fd.readlines()[0]
-            time = float(first_line)
-            logger.debug(f'  Time for run: {time}')
-        except:
-            logger.debug(f'  Failed to parse out float from time file, first_line: {first_line}')
-            return False, time
+    time = run_result.times
+    counters = run_result.counters
+    logger.debug(f'  Time for run: {time.wall} (user {time.user}, sys {time.sys}, '
+                 f'max RSS {time.maxrss} KiB)')
+    if counters is not None:
+        logger.debug(f'  Counters for run: {counters}')
 
     logger.debug(f'    - Try to match output with expected pattern')
-    expected_output = io_pair.output
-    if os.path.isfile(io_pair.output):
-        with open(io_pair.output, 'r') as fd:
-            expected_output = fd.read()
-
-    match = re.fullmatch(expected_output, run_output)
-    if match:
+    with oraql_events.phase('verify'):
+        matched = matcher.match(run_output)
+    if matched:
         logger.debug(f'    - Output matched expected pattern '
-                     f'{len(expected_output)} vs {len(run_output)}')
-        return True, time
+                     f'{len(matcher.expected_output)} vs {len(run_output)}')
+        return True, time, counters
 
-    for pair in zip(expected_output.splitlines(), run_output.splitlines()):
-        match = re.fullmatch(*pair)
-        if not match:
-            logger.debug(f'    - Output "%s" did not match expected pattern "%s"'%(pair))
+    for pair in matcher.mismatches(run_output):
+        logger.debug(f'    - Output "%s" did not match expected pattern "%s"'%(pair))
 
     logger.debug(f'    - Match failed, write got.txt')
     with open('got.txt', 'w') as fd:
         fd.write(run_output)
 
-    return False, time
-
-import hashlib
-def md5(fname):
-  hash_md5 = hashlib.md5()
-  with open(fname, "rb") as f:
-    for chunk in iter(lambda: f.read(4096), b""):
-      hash_md5.update(chunk)
-  return hash_md5.hexdigest()
-
+    return False, time, counters
+
+def collectCounters():
+    return oraql_settings.perfcounters or oraql_settings.timing_metric != 'time'
+
+def metricValue(measurement):
+    '''
+    The value of oraql_settings.timing_metric for a measurement of
+    runAllPairs. Lower is better.
+    '''
+    metric = oraql_settings.timing_metric
+    if metric == 'time':
+        return measurement['time']
+    for event in ['cycles', 'instructions'] if metric == 'ipc' else [metric]:
+        if event not in measurement:
+            raise RuntimeError(f'{oraql_settings.perfcommand} did not report '
+                               f'"{event}", needed for metric {metric}')
+    if metric == 'ipc':
+        return measurement['cycles'] / measurement['instructions']
+    return measurement[metric]
+
+def runAllPairs(benchmark):
+    '''
+    Run and verify every input/output pair once. Returns the total wall
+    clock time and hardware counters of the runs, or None if one of them
+    failed.
+    '''
+    measurement = {'time': 0}
+    for iop in benchmark.input_output_pairs:
+        success, time, counters = runAndVerify(benchmark, iop)
+        if not success:
+            return None
+        measurement['time'] += time.wall
+        for event, value in (counters or {}).items():
+            measurement[event] = measurement.get(event, 0) + value
+    return measurement
+
+def timeConfiguration(benchmark, times, runs, baseline):
+    '''
+    Add runs of the current executable to the measured `times`, samples of
+    metricValue: a fixed number for the baseline, or, when comparing against
+    a `baseline`, until it is clear whether the difference is significant.
+    The measurements of the new runs are appended to `runs`.
+    '''
+    def run():
+        measurement = runAllPairs(benchmark)
+        if measurement is None:
+            return None
+        runs.append(measurement)
+        return metricValue(measurement)
+    # warm-up runs are not samples, so they are left out of `runs`
+    def warmUp():
+        return runAllPairs(benchmark)
+    if baseline is None:
+        return oraql_timing.measure(run, oraql_settings.timing_baseline_runs, times, warm_up=warmUp)
+    return oraql_timing.measureAgainst(run, baseline, significant_percentage, times, warm_up=warmUp)
+
+# Results of previously verified executables, see oraql_cache.ResultCache
 _seen_before = dict()
-def compileAndRunOneConfiguration(benchmark, seqs, problemsizes, initialBuild = False):
+# Identifies this search in the result cache. Timing samples are only
+# reused within the search that took them, so that all configurations are
+# compared under the same load on the same node, baseline included.
+_session = None
+# Object files of previous compiles, see oraql_cache.BuildCache
+_build_cache = None
+# Hash of the executable linked from objects, by oraql_cache.objectsFingerprint
+_linked = dict()
+
+@oraql_events.probe
+def compileAndRunOneConfiguration(benchmark, seqs, problemsizes, initialBuild = False, baseline = None):
+    '''
+    Build and verify the configuration `seqs`, then time it, see
+    timeConfiguration. Returns success, the problem sizes and the measured
+    samples of the timing metric.
+    '''
     global _seen_before
     TIME.sleep(1)
-    time = None
+    times = None
+    runs = []
     # compile individual files into object files
     with tempfile.NamedTemporaryFile() as fp:
       for source_file in benchmark.source_files:
-          logger.debug(f'- Compiling {source_file.path} with seq {str_BinListAsHex(seqs[source_file.path])}')
-          seqstr = " ".join([str(s) for s in seqs[source_file.path]])
-          options = source_file.options + benchmark.options
-          cmd = " ".join([*options, '-O3', '-mllvm', '-stats', '-mllvm', f'-opt-aa-seq="{seqstr}"', '-flegacy-pass-manager'])
+          logger.debug(f'- Compiling {source_file.path} with seq {seqs[source_file.path].hex(leading_one=True)}')
+          seqstr = seqs[source_file.path].optAASeq()
+          options = oraql_command.compilerOptions(source_file.options + benchmark.options)
+          cmd = " ".join([oraql_command.commandLine(options), '-O3', '-mllvm', '-stats', '-mllvm', f'-opt-aa-seq="{seqstr}"', '-flegacy-pass-manager'])
+          only_functions = oraql_command.onlyFunctionsOption(source_file)
+          if only_functions:
+              cmd += f' -mllvm {only_functions}'
           if(initialBuild):
               if "opt-aa-target" in cmd:
                   cmd = cmd.replace("opt-aa-target=", "opt-aa-target=foooo")
@@ -255,89 +350,146 @@ def compileAndRunOneConfiguration(benchmark, seqs, problemsizes, initialBuild =
           problemsizes[source_file.path] = max(thisproblemsize, problemsizes[source_file.path])
           if not success:
               logger.debug(f'tmpfile content was: {cmd}')
-              logger.info(f'Failed compilation with seq {str_BinListAsHex(seqs[source_file.path])}')
-              return False, problemsizes, time
+              logger.info(f'Failed compilation with seq {seqs[source_file.path].hex(leading_one=True)}')
+              return False, problemsizes, times
 
       # link object files into executable
-      success = linkExecutable(benchmark)
-      if not success:
+      md5sum = oraql_cache.linkOrReuse(benchmark, objectFiles(benchmark), linkExecutable,
+                                       _linked, _seen_before, _build_cache)
+      if md5sum is None:
           logger.info(f'Failed linking with seq {seqs}')
-          return False, problemsizes, time
+          return False, problemsizes, times
       logger.debug(f'    Compiled. Compare executable file to previously seen files')
-      md5sum = md5(benchmark.executable)
-      if(md5sum in _seen_before):
-          if not _seen_before[md5sum]["res"]:
-              logger.debug(f'   We have seen this executable previously, and it was a failure: {_seen_before[md5sum]["time"]}')
-              return False, _seen_before[md5sum]["problemsizes"], _seen_before[md5sum]["time"]
-          else:
-              logger.debug(f'   We have seen this executable previously, and it was a success: {_seen_before[md5sum]["time"]}')
-              copyExecutable(benchmark.executable, 'last', fp.name)
-              return True, _seen_before[md5sum]["problemsizes"], _seen_before[md5sum]["time"]
-      logger.debug(f'    This is a new executable, continue with verification.')
-
-      # run the generated executable for each input/output pair
-      for iop in benchmark.input_output_pairs:
-          success, time = runAndVerify(benchmark, iop)
-          if not success:
+      seen = _seen_before.get(md5sum)
+      oraql_events.cacheLookup('result', seen is not None)
+      if seen is not None:
+          problemsizes = oraql_cache.mergeProblemSizes(problemsizes, seen["problemsizes"])
+          # samples of another metric or search cannot be compared
+          if (seen.get("metric") == oraql_settings.timing_metric
+                  and seen.get("session") == _session):
+              times = seen.get("times")
+              runs = seen.get("runs", [])
+          if not seen["res"]:
+              logger.debug(f'   We have seen this executable previously, and it was a failure: {times}')
+              return False, problemsizes, times
+          logger.debug(f'   We have seen this executable previously, and it was a success: {times}')
+      else:
+          logger.debug(f'    This is a new executable, continue with verification.')
+
+          # run the generated executable for each input/output pair
+          if runAllPairs(benchmark) is None:
               logger.debug(f'    unsuccessful execution.')
-              _seen_before[md5sum] = {"res": False, "problemsizes": problemsizes, "time":time}
-              logger.info(f'Failed execution with seq {[(seq,str_BinListAsHex(seqs[seq])) for seq in seqs]}')
-              return False, problemsizes, time
-
-      # if we made it here, it means that all object files compiled, the
-      # executable linked and executed, and the results were correct for every
-      # input/output pair. Success!
-      logger.info(f'Successful test for all i/o pairs')
-      _seen_before[md5sum] = {"res": True, "problemsizes": problemsizes, "time":time}
-      copyExecutable(benchmark.executable, 'last', fp.name)
-    return True, problemsizes, time
-
-def compileAndRunAllConfigurations(benchmark, problemsizes, seqs, initial_time):
-    # seqs = {x.path:[0]*problemsizes[x.path] for x in benchmark.source_files}
+              _seen_before[md5sum] = {"res": False, "problemsizes": problemsizes, "times": times}
+              logger.info(f'Failed execution with seq {[(seq,seqs[seq].hex(leading_one=True)) for seq in seqs]}')
+              return False, problemsizes, times
+
+          # if we made it here, it means that all object files compiled, the
+          # executable linked and executed, and the results were correct for every
+          # input/output pair. Success!
+          logger.info(f'Successful test for all i/o pairs')
+          times = []
+
+      # measured runs already taken, e.g. by a previous search, are kept
+      new_times = timeConfiguration(benchmark, times or [], runs, baseline)
+      if new_times is None:
+          logger.info(f'Failed execution while timing seq {[(seq,seqs[seq].hex(leading_one=True)) for seq in seqs]}')
+          _seen_before[md5sum] = {"res": False, "problemsizes": problemsizes, "times": times}
+          return False, problemsizes, times
+      times = new_times
+      logger.debug(f'    Median {oraql_settings.timing_metric} {oraql_timing.median(times)} of {len(times)} runs')
+      _seen_before[md5sum] = {"res": True, "problemsizes": problemsizes,
+                              "metric": oraql_settings.timing_metric,
+                              "session": _session, "times": times, "runs": runs}
+      _build_cache.store(md5sum, '.exe', benchmark.executable, [])
+      copyExecutable(benchmark.executable, 'last', seqs=seqs)
+    return True, problemsizes, times
+
+def compileAndRunAllConfigurations(benchmark, problemsizes, seqs, initial_times, orders=None):
+    # seqs = {x.path:oraql_seq.BitSeq(problemsizes[x.path]) for x in benchmark.source_files}
     for source_file in benchmark.source_files:
         logger.debug(f'Optimistic probing for {source_file.path}')
-        seqs, problemsizes, time = split_n_try(seqs, 0, len(seqs[source_file.path]), source_file, benchmark, problemsizes, initial_time)
+        ranges = (orders or {}).get(source_file.path, [(0, len(seqs[source_file.path]))])
+        for start, end in ranges:
+            seqs, problemsizes, times = split_n_try(seqs, start, end, source_file, benchmark, problemsizes, initial_times)
     return seqs
 
-def split_n_try(seqs, start, orig_end, source_file, benchmark, problemsizes, initial_time):
+def profileOrder(benchmark, seqs):
+    '''
+    The ranges to search per source file, those of the hottest functions of
+    the initial executable first, see oraql_profile. Returns None if the
+    search is to go in index order.
+    '''
+    if not oraql_settings.profile_search:
+        return None
+    if not shutil.which(oraql_settings.perfcommand):
+        logger.warning(f'Profile-guided search requested, but {oraql_settings.perfcommand} was not found')
+        return None
+    shares = oraql_profile.profile(benchmark, f'{benchmark.executable}.t.initial')
+    if not shares:
+        logger.warning(f'Failed to profile {benchmark.executable}.t.initial, searching in index order')
+        return None
+    index = oraql_provenance.openProvenanceIndex()
+    orders = dict()
+    for source_file in benchmark.source_files:
+        revision = oraql_provenance.revision(benchmark, source_file)
+        if (source_file.path, revision) not in index:
+            logger.warning(f'No provenance index of {source_file.path}, searching it in index order. '
+                           f'Run oraql_chunked with provenanceoption set first.')
+            continue
+        hot = oraql_profile.hotRanges(index, source_file.path, revision, shares,
+                                      oraql_settings.profile_top_functions)
+        for function, share, ranges in hot:
+            logger.info(f'- Hot function {function} ({share:.1f}%): queries {ranges}')
+        orders[source_file.path] = oraql_profile.searchOrder(hot, len(seqs[source_file.path]),
+                                                             oraql_settings.profile_hot_only)
+    return orders
+
+def split_n_try(seqs, start, orig_end, source_file, benchmark, problemsizes, initial_times):
   '''
   Try if [start, end) is safe to add to the sequence. If yes, do so.
   If no, bisect.
+
+  A range is important if making its queries pessimistic changes the
+  runtime significantly, see oraql_timing.differs.
   '''
   end = orig_end
   if(orig_end == -1):
     end = problemsizes[source_file.path]
+  initial_time = oraql_timing.median(initial_times)
   print(f"splitntry {start} {orig_end} {end}, {initial_time}")
   previous_seq = seqs[source_file.path]
   success = False
-  seqs[source_file.path] = [0 if (i >= start and i < end) else seqs[source_file.path][i] for i in range(len(seqs[source_file.path]))]
-  success, problemsizes, time = compileAndRunOneConfiguration(benchmark, seqs, problemsizes)
+  seqs[source_file.path] = seqs[source_file.path].clearRange(start, end)
+  oraql_events.setContext(source=source_file.path, range=[start, end])
+  success, problemsizes, times = compileAndRunOneConfiguration(benchmark, seqs, problemsizes, baseline=initial_times)
   seqs[source_file.path] = previous_seq
   if not success:
-      time = initial_time
-  time_ratio = abs(100*initial_time / time)
-  print(f"time: {initial_time} vs {time} --> {time_ratio}")
-  if success and abs(time_ratio - 100) < significant_percentage:
-    return seqs, problemsizes, time
-
-  best_time = time
+      times = initial_times
+  time = oraql_timing.median(times)
+  difference = oraql_timing.relativeDifference(initial_times, times)
+  print(f"time: {initial_time} vs {time} --> {difference:+.2f}%")
+  if success and not oraql_timing.differs(initial_times, times, significant_percentage):
+    return seqs, problemsizes, times
+
+  best_times = times
   middle = start + (end - start) // 2
   if(middle > start and middle < end):
-    left, problemsize_l, time_l = split_n_try(seqs, start, middle, source_file, benchmark, problemsizes, initial_time)
-    right, problemsize_r, time_r = split_n_try(seqs, middle, orig_end, source_file, benchmark, problemsizes, initial_time)
+    left, problemsize_l, times_l = split_n_try(seqs, start, middle, source_file, benchmark, problemsizes, initial_times)
+    right, problemsize_r, times_r = split_n_try(seqs, middle, orig_end, source_file, benchmark, problemsizes, initial_times)
     problemsizes[source_file.path] = max(problemsize_l[source_file.path], problemsize_r[source_file.path])
     # seqs[source_file.path] = [0 if left[source_file.path][i] == 0 else right[source_file.path][i] for i in range(len(seqs[source_file.path]))]
-    best_time = min(best_time, time_l, time_r)
-    time_l_ratio = abs(100*initial_time/time_l)
-    time_r_ratio = abs(100*initial_time/time_r)
-    print(f"LTR: {time_l_ratio} RTR: {time_r_ratio}")
-    keep = abs(time_l_ratio - 100) < significant_percentage and abs(time_r_ratio - 100) < significant_percentage
+    best_times = oraql_timing.fastest(best_times, times_l, times_r)
+    difference_l = oraql_timing.relativeDifference(initial_times, times_l)
+    difference_r = oraql_timing.relativeDifference(initial_times, times_r)
+    print(f"LTR: {difference_l:+.2f}% RTR: {difference_r:+.2f}%")
+    keep = (not oraql_timing.differs(initial_times, times_l, significant_percentage) and
+            not oraql_timing.differs(initial_times, times_r, significant_percentage))
     if keep:
-        seqs[source_file.path] = [0 if (i >= middle and i < end) else seqs[source_file.path][i] for i in range(len(seqs[source_file.path]))]
-        left, problemsize_l, time_l = split_n_try(seqs, start, middle, source_file, benchmark, problemsizes, initial_time)
+        seqs[source_file.path] = seqs[source_file.path].clearRange(middle, end)
+        left, problemsize_l, times_l = split_n_try(seqs, start, middle, source_file, benchmark, problemsizes, initial_times)
         seqs[source_file.path] = previous_seq
-        seqs[source_file.path] = [0 if (i >= start and i < middle) else seqs[source_file.path][i] for i in range(len(seqs[source_file.path]))]
-        right, problemsize_r, time_r = split_n_try(seqs, middle, orig_end, source_file, benchmark, problemsizes, initial_time)
+        seqs[source_file.path] = seqs[source_file.path].clearRange(start, middle)
+        right, problemsize_r, times_r = split_n_try(seqs, middle, orig_end, source_file, benchmark, problemsizes, initial_times)
         seqs[source_file.path] = previous_seq
         # start_center = start + (middle - start) // 2
         # end_center = start_center + (end - start) // 2
@@ -349,31 +501,46 @@ def split_n_try(seqs, start, orig_end, source_file, benchmark, problemsizes, ini
     keep = True
 
   if keep:
-    os.system(f"echo 'version {start}-{end}: {initial_time} vs {time} (best: {best_time}) --> {time_ratio}' >> {version_file}")
+    os.system(f"echo 'version {start}-{end}: {initial_time} vs {time} (best: {oraql_timing.median(best_times)}) --> {difference:+.2f}%' >> {version_file}")
     copyExecutable(f"{benchmark.executable}.last", f'{start}-{end}', f'{benchmark.executable}.last.sequence.txt')
-  return seqs, problemsizes, best_time
+  return seqs, problemsizes, best_times
 
 def getInitialSeq(benchmark):
     sf = benchmark.source_files[0]
-    return {sf.path: [0]}
+    return {sf.path: oraql_seq.BitSeq(1)}
 
 def getFinalSeq(benchmark):
-    with open(f'{benchmark.executable}.final.sequence.txt', 'r') as fd:
-        content = fd.read()
-        assert len(benchmark.source_files) == 1
-        sf = benchmark.source_files[0]
-        return {sf.path: [int(x) for x in re.search('-opt-aa-seq="([0 1]*)"', content).group(1).split(" ")]}
+    assert len(benchmark.source_files) == 1
+    sf = benchmark.source_files[0]
+    seqs = oraql_seq.readSeqFile(f'{benchmark.executable}.final.sequence.txt', [sf.path])
+    return {sf.path: seqs[sf.path]}
 
 def runBenchmark(benchmark_file):
+    global _seen_before, _build_cache, _session
     benchmark = readBenchmarkFile(benchmark_file)
     logger.info(f'Start benchmark {benchmark.name}')
+    _session = f'{socket.gethostname()}:{os.getpid()}:{TIME.time()}'
+    _seen_before = oraql_cache.openResultCache(benchmark)
+    _build_cache = oraql_cache.openBuildCache()
+    oraql_command.configure(benchmark)
+    if not oraql_command.prepareLink(benchmark):
+        logger.error(f'Failed to build the prebuilt objects with {benchmark.link.prepare_cmd}')
+        return False
+    core_sets = oraql_affinity.coreSets(benchmark, 1)
+    oraql_affinity.assignCpus(core_sets[0] if core_sets else None)
+    if collectCounters() and not shutil.which(oraql_settings.perfcommand):
+        logger.error(f'Hardware counters requested, but {oraql_settings.perfcommand} was not found')
+        return False
     benchmark_path = os.path.dirname(benchmark_file)
+    oraql_events.openEventLog(oraql_settings.eventlog, driver='identify_important',
+                              benchmark=benchmark.name)
 
     success = False
     seqs = getFinalSeq(benchmark)
     problemsizes = {x.path:0 for x in benchmark.source_files}
-    success, problemsizes, initial_time = compileAndRunOneConfiguration(benchmark, seqs, problemsizes)
-    os.system(f"echo 'version final: {initial_time}' >> {version_file}")
+    oraql_events.setContext(initial=True)
+    success, problemsizes, initial_times = compileAndRunOneConfiguration(benchmark, seqs, problemsizes)
+    os.system(f"echo 'version final: {oraql_timing.median(initial_times) if success else None}' >> {version_file}")
     # success, problemsizes, initial_time = compileAndRunOneConfiguration(benchmark, getInitialSeq(benchmark), problemsizes, True)
     # os.system(f"echo 'version initial: {initial_time}' >> {version_file}")
     if success:
@@ -381,13 +548,15 @@ def runBenchmark(benchmark_file):
                     f'optimistic optimization for '
                     f'{len(benchmark.source_files)} source files')
         copyExecutable(benchmark.executable, 't.initial')
-        seqs = compileAndRunAllConfigurations(benchmark, problemsizes, seqs, initial_time)
+        orders = profileOrder(benchmark, seqs)
+        seqs = compileAndRunAllConfigurations(benchmark, problemsizes, seqs, initial_times, orders)
     else:
         logger.info(f'- Initial build of {benchmark.name} failed')
 
     logger.info(f'Finished benchmark {benchmark.name}, '
                 f'{"" if success else "un"}successful')
-    logger.info(f'Final sequence: {[(seq,str_BinListAsHex(seqs[seq])) for seq in seqs]}')
+    logger.info(f'Final sequence: {[(seq,seqs[seq].hex(leading_one=True)) for seq in seqs]}')
+    return success
 
 benchmark_files = ['./benchmark.ot']
 
@@ -404,13 +573,15 @@ if len(benchmark_files) > 1:
 
 base_path = os.path.abspath(os.curdir)
 os.chdir(base_path)
+# exit nonzero if the search failed, e.g. for oraql_batch
+success = False
 try:
-    runBenchmark(benchmark_files[0])
+    success = runBenchmark(benchmark_files[0])
 except Exception as e:
-    logger.error(f' The execution of {benchmark_file} ended in an '
+    logger.error(f' The execution of {benchmark_files[0]} ended in an '
                     f' uncaught exception:\n{e!s}', exc_info=True)
 
-sys.exit(0)
+sys.exit(0 if success else 1)
 with open(version_file, 'r') as fd:
     lines = fd.readlines()
     assert 'initial' in lines[0]
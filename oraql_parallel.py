@@ -0,0 +1,328 @@
+import os
+import time
+import errno
+import fcntl
+import signal
+import shutil
+import socket
+import logging
+import tempfile
+import contextlib
+import traceback
+import multiprocessing as mp
+from multiprocessing.connection import wait
+
+import oraql_settings
+import oraql_affinity
+import oraql_events
+
+logger = logging.getLogger('')
+
+# Files and directories in the benchmark directory that must not be copied
+# into the per-worker scratch directories.
+SCRATCH_IGNORE = shutil.ignore_patterns('.oraql-*', 'oraql-events*', '__pycache__')
+
+# File in a scratch root naming the host and process that own it
+SCRATCH_OWNER = 'owner'
+
+# Slots of the bounded stages of the pool this process is a worker of, by
+# stage name, as lists of (lock file, core set), see stage
+_stage_slots = dict()
+# Ticket of the probe this worker evaluates, and the shared value holding
+# the ticket of the probe the search waits for, see stage
+_ticket = None
+_head = None
+
+@contextlib.contextmanager
+def stage(name):
+    '''
+    Enter stage `name` of a probe, e.g. "run", waiting while as many other
+    workers as the stage allows are in it. Outside of a worker, or for
+    stages without a limit, this does not wait. The time spent waiting is
+    logged as phase "<name> wait".
+
+    Slots are flock()ed files rather than semaphores, since the kernel
+    releases the lock of a worker that is killed in the middle of a stage.
+    The first slot is kept for the probe the search waits for, so that
+    speculative probes cannot hold it up. A slot with a core set pins the
+    runs of the worker to that set while it is held.
+    '''
+    slots = _stage_slots.get(name)
+    if not slots:
+        yield
+        return
+    fds = [os.open(path, os.O_RDWR | os.O_CREAT) for path, _ in slots]
+    try:
+        with oraql_events.phase(f'{name} wait'):
+            held = None
+            while held is None:
+                first = 0 if _head.value == _ticket else 1
+                for i in range(first, len(fds)):
+                    try:
+                        fcntl.flock(fds[i], fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        held = i
+                        break
+                    except BlockingIOError:
+                        pass
+                else:
+                    time.sleep(0.05)
+        cpus = slots[held][1]
+        if cpus is None:
+            yield
+        else:
+            previous = oraql_affinity.assignedCpus()
+            oraql_affinity.assignCpus(cpus)
+            try:
+                yield
+            finally:
+                oraql_affinity.assignCpus(previous)
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def removeStaleScratchRoots(prefix):
+    '''
+    Remove the scratch roots named `prefix`* whose owner on this host no
+    longer runs, e.g. because the driver was killed during the search.
+    '''
+    parent = oraql_settings.scratchdir or tempfile.gettempdir()
+    host = socket.gethostname()
+    for name in os.listdir(parent):
+        if not name.startswith(prefix):
+            continue
+        root = os.path.join(parent, name)
+        try:
+            with open(os.path.join(root, SCRATCH_OWNER), 'r') as fd:
+                owner_host, pid = fd.read().split()
+            stale = owner_host == host and not _alive(int(pid))
+        except (OSError, ValueError):
+            continue
+        if stale:
+            logger.debug(f'- Removing stale scratch directory {root}')
+            shutil.rmtree(root, ignore_errors=True)
+
+def makeScratchRoot(prefix):
+    '''
+    A new directory for scratch copies below oraql_settings.scratchdir. It
+    names its owner, so that the next run removes it if the owner exits
+    without cleaning up, see removeStaleScratchRoots.
+    '''
+    removeStaleScratchRoots(prefix)
+    root = tempfile.mkdtemp(prefix=prefix, dir=oraql_settings.scratchdir)
+    with open(os.path.join(root, SCRATCH_OWNER), 'w') as fd:
+        fd.write(f'{socket.gethostname()} {os.getpid()}\n')
+    return root
+
+def moveFile(source, target):
+    '''
+    Move `source` to `target`, replacing it atomically, also if the scratch
+    directory is on another file system than the target.
+    '''
+    try:
+        os.replace(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        tmp = f'{target}.{os.getpid()}.tmp'
+        shutil.copy2(source, tmp)
+        os.replace(tmp, target)
+        os.remove(source)
+
+def makeScratchCopy(base_path, scratch_root):
+    '''
+    Copy the benchmark directory `base_path` into a fresh directory below
+    `scratch_root` and return its path. Every probe that runs concurrently
+    with others needs its own copy, so that object files, bitcode and the
+    executable produced by one probe do not overwrite those of another.
+    '''
+    work_path = os.path.join(tempfile.mkdtemp(dir=scratch_root), 'work')
+    shutil.copytree(base_path, work_path, symlinks=True, ignore=SCRATCH_IGNORE)
+    return work_path
+
+def _workerLoop(conn, work_path, probe_fn, cpus, stage_slots, head):
+    global _stage_slots, _ticket, _head
+    # own process group, so a preempted probe can be killed together with
+    # the compiler, make or benchmark process it is waiting for
+    os.setsid()
+    os.chdir(work_path)
+    oraql_affinity.assignCpus(cpus)
+    _stage_slots = stage_slots
+    _head = head
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        key, _ticket, args = task
+        try:
+            conn.send((key, True, probe_fn(*args)))
+        except Exception:
+            conn.send((key, False, traceback.format_exc()))
+
+class _Slot:
+    def __init__(self, ctx, work_path, probe_fn, cpus, stage_slots, head):
+        self.work_path = work_path
+        self.cpus = cpus
+        self.stage_slots = stage_slots
+        self.head = head
+        self.key = None
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_workerLoop,
+                                   args=(child_conn, work_path, probe_fn, cpus,
+                                         stage_slots, head),
+                                   daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.join()
+        self.conn.close()
+
+class ProbePool:
+    '''
+    Pool of worker processes that evaluate probes concurrently, each worker
+    in its own scratch copy of the benchmark directory.
+
+    Probes are identified by a hashable key. The search asks for the probe
+    it needs next together with the probes it is likely to need afterwards
+    (speculation), and then waits for the results in its own order, which
+    keeps the outcome identical to a serial run. Workers busy with a probe
+    that is no longer expected are killed when their slot is needed.
+
+    `stage_limits` bounds how many workers may be in a stage of their probe
+    at the same time, e.g. {'run': 1} to run one benchmark at a time while
+    the other workers compile the probes that follow, see stage.
+
+    With `cpu_sets`, a list of one core set per concurrent run, benchmark
+    runs are pinned to their own set, see oraql_affinity: with a limit on
+    the "run" stage, the set of the run slot a worker holds, otherwise the
+    set of the worker.
+
+    A worker that dies is replaced, and its probe is started again when its
+    result is needed, at most oraql_settings.probe_retries times.
+    '''
+    def __init__(self, jobs, probe_fn, base_path=None, cpu_sets=None, stage_limits=None):
+        self.jobs = jobs
+        self.probe_fn = probe_fn
+        self.base_path = os.path.abspath(base_path or os.curdir)
+        self.scratch_root = makeScratchRoot('oraql-scratch-')
+        stage_slots = {name: [(os.path.join(self.scratch_root, f'{name}.{i}.lock'),
+                               cpu_sets[i] if cpu_sets and name == 'run' else None)
+                              for i in range(limit)]
+                       for name, limit in (stage_limits or {}).items()
+                       if limit and limit < jobs}
+        worker_cpus = cpu_sets if cpu_sets and 'run' not in stage_slots else None
+        # fork, so that workers inherit the already loaded driver module
+        # instead of re-running it
+        self.ctx = mp.get_context('fork')
+        self.head = self.ctx.Value('q', -1, lock=False)
+        self.slots = [_Slot(self.ctx, makeScratchCopy(self.base_path,
+                                                      self.scratch_root),
+                            probe_fn, worker_cpus[i] if worker_cpus else None,
+                            stage_slots, self.head)
+                      for i in range(jobs)]
+        self.results = dict()
+        self.attempts = dict()
+        self.tickets = dict()
+
+    def _running(self, key):
+        return any(slot.key == key for slot in self.slots)
+
+    def _respawn(self, slot):
+        i = self.slots.index(slot)
+        slot.kill()
+        self.slots[i] = _Slot(self.ctx, slot.work_path, self.probe_fn,
+                              slot.cpus, slot.stage_slots, slot.head)
+        return self.slots[i]
+
+    def _lost(self, slot):
+        key = slot.key
+        logger.warning(f'- Lost probe worker {slot.process.pid}')
+        self._respawn(slot)
+        if key is not None:
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+            if self.attempts[key] > oraql_settings.probe_retries:
+                raise RuntimeError(f'Probe lost with {self.attempts[key]} workers, giving up')
+
+    def _freeSlot(self, expected):
+        for slot in self.slots:
+            if slot.key is None:
+                return slot
+        for slot in self.slots:
+            if slot.key not in expected:
+                return self._respawn(slot)
+        return None
+
+    def submit(self, key, args, expected=()):
+        '''
+        Start the probe `key` unless it is already running or done. Returns
+        False if every worker is busy with a probe in `expected`.
+        '''
+        if key in self.results or self._running(key):
+            return True
+        slot = self._freeSlot(expected)
+        if slot is None:
+            return False
+        task = (key, self.tickets.setdefault(key, len(self.tickets)), args)
+        try:
+            slot.conn.send(task)
+        except OSError:
+            # the worker died while idle
+            slot = self._respawn(slot)
+            slot.conn.send(task)
+        slot.key = key
+        return True
+
+    def _collect(self):
+        busy = {slot.conn: slot for slot in self.slots if slot.key is not None}
+        for conn in wait(list(busy)):
+            slot = busy[conn]
+            try:
+                key, ok, result = conn.recv()
+            except (EOFError, OSError):
+                self._lost(slot)
+                continue
+            slot.key = None
+            if not ok:
+                raise RuntimeError(f'Probe failed in worker:\n{result}')
+            self.results[key] = result
+
+    def result(self, key, args, expected=()):
+        self.submit(key, args, expected=(key, *expected))
+        self.head.value = self.tickets.get(key, -1)
+        while key not in self.results:
+            # the worker of the probe may have been lost
+            if not self._running(key):
+                self.submit(key, args, expected=(key, *expected))
+            self._collect()
+        return self.results[key]
+
+    def discard(self, keep=()):
+        '''
+        Forget the results of probes other than `keep` and return them.
+        '''
+        return [self.results.pop(k) for k in list(self.results) if k not in keep]
+
+    def close(self):
+        for slot in self.slots:
+            try:
+                if slot.key is None:
+                    slot.conn.send(None)
+                    slot.process.join()
+                    continue
+            except OSError:
+                pass
+            slot.kill()
+        shutil.rmtree(self.scratch_root, ignore_errors=True)
@@ -0,0 +1,137 @@
+import os
+import re
+import json
+import signal
+import hashlib
+import tempfile
+import subprocess as sp
+
+import oraql_settings
+import oraql_cache
+import oraql_affinity
+
+def recordCommand(cmd, data_path):
+    '''
+    `cmd` wrapped in `perf record`, sampling at oraql_settings.profile_frequency
+    into `data_path`.
+    '''
+    return [oraql_settings.perfcommand, 'record', '-q', '-F', str(oraql_settings.profile_frequency),
+            '-o', data_path, '--'] + cmd
+
+def reportCommand(data_path):
+    # symbols are not demangled, so that they match the function names the
+    # compiler reports for the queries
+    return [oraql_settings.perfcommand, 'report', '-i', data_path, '--stdio', '-q',
+            '--no-children', '--no-demangle', '--sort', 'symbol']
+
+def functionName(symbol):
+    '''
+    The function a symbol belongs to, without the suffixes of the parts the
+    optimizer split off.
+    '''
+    return re.sub(r'(\.(cold|part\.\d+|isra\.\d+|constprop\.\d+))+$', '', symbol)
+
+def parseReport(output):
+    '''
+    Share of the samples per function, in percent, from the output of
+    reportCommand. Samples outside the benchmark's code, e.g. in the kernel,
+    are left out.
+    '''
+    shares = dict()
+    for line in output.splitlines():
+        m = re.match(r'\s*([\d.]+)%\s+\[\.\]\s+(\S+)', line)
+        if m:
+            function = functionName(m.group(2))
+            shares[function] = shares.get(function, 0) + float(m.group(1))
+    return shares
+
+def _cachePath(benchmark, executable):
+    key = oraql_cache.fileDigest(executable) + json.dumps(
+        [iop.input for iop in benchmark.input_output_pairs])
+    return os.path.join(oraql_settings.cachedir,
+                        f'profile-{hashlib.sha1(key.encode()).hexdigest()}.json')
+
+def record(cmd, data_path, env, cpus, timeout):
+    '''
+    Run `cmd` under `perf record`. Returns False if perf could not be run,
+    or the run failed or timed out; the benchmark, in its own process group,
+    is then killed with perf.
+    '''
+    try:
+        proc = sp.Popen(recordCommand(cmd, data_path), stdout=sp.DEVNULL, stderr=sp.DEVNULL,
+                        env=env, start_new_session=True,
+                        preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None)
+    except OSError:
+        return False
+    try:
+        return proc.wait(timeout=timeout) == 0
+    except sp.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        proc.wait()
+        return False
+
+def profile(benchmark, executable):
+    '''
+    Share of the runtime spent in each function by `executable`, running all
+    input/output pairs of `benchmark` under `perf record`. The profile of an
+    executable is kept in the cache directory, so it is only recorded once.
+    Returns None if profiling failed.
+    '''
+    cache_path = _cachePath(benchmark, executable)
+    if os.path.isfile(cache_path):
+        with open(cache_path, 'r') as fd:
+            return json.load(fd)
+    shares = dict()
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, iop in enumerate(benchmark.input_output_pairs):
+            data_path = os.path.join(tmp, f'perf{i}.data')
+            cmd, env, cpus = oraql_affinity.runSettings(benchmark, [executable] + iop.input)
+            if not record(cmd, data_path, env, cpus, iop.timeout) or not os.path.isfile(data_path):
+                return None
+            try:
+                report = sp.run(reportCommand(data_path), stdout=sp.PIPE, stderr=sp.DEVNULL)
+            except OSError:
+                return None
+            if report.returncode != 0:
+                return None
+            # the input/output pairs are weighted equally
+            for function, share in parseReport(report.stdout.decode('utf8', errors='replace')).items():
+                shares[function] = shares.get(function, 0) + share / len(benchmark.input_output_pairs)
+    os.makedirs(oraql_settings.cachedir, exist_ok=True)
+    with open(cache_path, 'w') as fd:
+        json.dump(shares, fd)
+    return shares
+
+def hotRanges(index, source_path, revision, shares, top):
+    '''
+    The query ranges of the `top` hottest functions of `source_path` by
+    the profile `shares`, hottest function first, as (function, share,
+    ranges) using the provenance `index` of `revision`.
+    '''
+    by_function = dict()
+    for function, start, end in index.functionRanges(source_path, revision):
+        if function in shares:
+            by_function.setdefault(function, []).append((start, end))
+    hot = sorted(by_function, key=lambda function: -shares[function])[:top]
+    return [(function, shares[function], by_function[function]) for function in hot]
+
+def searchOrder(hot_ranges, length, hot_only=False):
+    '''
+    The ranges of queries to search: those of `hot_ranges` in their order,
+    followed by the rest of the `length` queries in index order unless
+    `hot_only`.
+    '''
+    ranges = [(start, min(end, length)) for _, _, function_ranges in hot_ranges
+              for start, end in function_ranges if start < length]
+    if hot_only:
+        return ranges
+    rest = []
+    start = 0
+    for hot_start, hot_end in sorted(ranges) + [(length, length)]:
+        if hot_start > start:
+            rest.append((start, hot_start))
+        start = max(start, hot_end)
+    return ranges + rest
@@ -0,0 +1,249 @@
+import os
+import re
+import sys
+import json
+import time
+import dotmap
+import sqlite3
+import argparse
+
+import oraql_settings
+import oraql_cache
+import oraql_command
+import oraql_seq
+
+def parseQueries(output):
+    '''
+    The queries described in the debug output of the compiler, as a dict
+    from query index to (function, line, pass). Parts the pattern in
+    oraql_settings.provenance_pattern does not capture are None.
+    '''
+    queries = dict()
+    for m in re.finditer(oraql_settings.provenance_pattern, output, re.MULTILINE):
+        fields = m.groupdict()
+        line = fields.get('line')
+        queries[int(fields['index'])] = (fields.get('function'),
+                                         int(line) if line else None,
+                                         fields.get('pass'))
+    return queries
+
+class ProvenanceIndex:
+    '''
+    Where the queries of a source file come from: function, source line and
+    the pass that asked, by query index. Kept per revision of the source
+    file, see revision, so that sequences found for one revision can be
+    carried over to the next. Function and pass names are stored once in a
+    name table, the queries as integer rows.
+    '''
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._db = None
+        self._pid = None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def _connection(self):
+        # connections must not be shared with forked worker processes
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=600)
+            self._db.executescript(
+                'CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, '
+                'name TEXT UNIQUE);'
+                'CREATE TABLE IF NOT EXISTS revisions (source TEXT, '
+                'revision TEXT, queries INTEGER, recorded REAL, '
+                'PRIMARY KEY (source, revision));'
+                'CREATE TABLE IF NOT EXISTS queries (source TEXT, '
+                'revision TEXT, query INTEGER, function INTEGER, '
+                'line INTEGER, pass INTEGER, '
+                'PRIMARY KEY (source, revision, query)) WITHOUT ROWID;')
+            self._pid = os.getpid()
+        return self._db
+
+    def _nameId(self, db, name):
+        if name is None:
+            return None
+        db.execute('INSERT OR IGNORE INTO names (name) VALUES (?)', (name,))
+        return db.execute('SELECT id FROM names WHERE name = ?', (name,)).fetchone()[0]
+
+    def store(self, source_path, revision, queries):
+        '''
+        Replace the index of `revision` of `source_path` by `queries`, as
+        returned by parseQueries.
+        '''
+        db = self._connection()
+        with db:
+            db.execute('DELETE FROM queries WHERE source = ? AND revision = ?',
+                       (source_path, revision))
+            db.executemany('INSERT INTO queries VALUES (?, ?, ?, ?, ?, ?)',
+                           [(source_path, revision, index,
+                             self._nameId(db, function), line,
+                             self._nameId(db, pass_name))
+                            for index, (function, line, pass_name) in queries.items()])
+            db.execute('INSERT OR REPLACE INTO revisions VALUES (?, ?, ?, ?)',
+                       (source_path, revision, len(queries), time.time()))
+
+    def __contains__(self, key):
+        source_path, revision = key
+        return self._connection().execute(
+            'SELECT 1 FROM revisions WHERE source = ? AND revision = ?',
+            (source_path, revision)).fetchone() is not None
+
+    def queries(self, source_path, revision, start=0, end=None):
+        '''
+        (index, function, line, pass) of the queries in [start, end).
+        '''
+        return self._connection().execute(
+            'SELECT query, f.name, line, p.name FROM queries '
+            'LEFT JOIN names f ON f.id = function LEFT JOIN names p ON p.id = pass '
+            'WHERE source = ? AND revision = ? AND query >= ? AND query < ? '
+            'ORDER BY query',
+            (source_path, revision, start, sys.maxsize if end is None else end)).fetchall()
+
+    def functionRanges(self, source_path, revision):
+        '''
+        The queries grouped into (function, start, end) runs of consecutive
+        indices that belong to the same function.
+        '''
+        ranges = []
+        for index, function, _, _ in self.queries(source_path, revision):
+            if ranges and ranges[-1][0] == function and ranges[-1][2] == index:
+                ranges[-1][2] = index + 1
+            else:
+                ranges.append([function, index, index + 1])
+        return [tuple(r) for r in ranges]
+
+    def revisions(self, source_path):
+        '''
+        (revision, number of queries) of the indexed revisions of
+        `source_path`, most recently recorded first.
+        '''
+        return self._connection().execute(
+            'SELECT revision, queries FROM revisions WHERE source = ? '
+            'ORDER BY recorded DESC', (source_path,)).fetchall()
+
+    def _keys(self, source_path, revision):
+        # a query is identified across revisions by its function, its pass
+        # and how many queries of that function and pass came before it;
+        # line numbers shift with every edit above the function
+        seen = dict()
+        keys = dict()
+        for index, function, _, pass_name in self.queries(source_path, revision):
+            ordinal = seen.get((function, pass_name), 0)
+            seen[(function, pass_name)] = ordinal + 1
+            keys[index] = (function, pass_name, ordinal)
+        return keys
+
+    def carryOver(self, source_path, seq, old_revision, new_revision, length):
+        '''
+        Translate `seq`, found for `old_revision`, to a sequence of `length`
+        queries for `new_revision`. Queries that cannot be matched in the
+        old revision stay pessimistic.
+        '''
+        old = {key: index for index, key in self._keys(source_path, old_revision).items()}
+        old_bits = seq.toString()
+        bits = ['0'] * length
+        for index, key in self._keys(source_path, new_revision).items():
+            old_index = old.get(key)
+            if index < length and old_index is not None and old_index < len(old_bits):
+                bits[index] = old_bits[old_index]
+        return oraql_seq.BitSeq.fromString(''.join(bits))
+
+    def describe(self, source_path, revision, start, end):
+        '''
+        Short description of the queries in [start, end) for log messages,
+        e.g. "residual:57-63 (licm)".
+        '''
+        parts = []
+        for function, lines, passes in self._summarize(self.queries(source_path, revision, start, end)):
+            where = function or '?'
+            if lines:
+                where += f':{lines[0]}' if lines[0] == lines[1] else f':{lines[0]}-{lines[1]}'
+            if passes:
+                where += f' ({", ".join(sorted(passes))})'
+            parts.append(where)
+        return '; '.join(parts)
+
+    def _summarize(self, rows):
+        by_function = dict()
+        for _, function, line, pass_name in rows:
+            lines, passes = by_function.setdefault(function, [None, set()])
+            if line is not None:
+                lines = [min(lines[0], line), max(lines[1], line)] if lines else [line, line]
+                by_function[function][0] = lines
+            if pass_name:
+                passes.add(pass_name)
+        return [(function, lines, passes) for function, (lines, passes) in by_function.items()]
+
+def openProvenanceIndex(base_path=None):
+    return ProvenanceIndex(os.path.join(base_path or os.curdir, oraql_settings.cachedir,
+                                        'provenance.sqlite'))
+
+def configuration(benchmark, source_file):
+    '''
+    Identifies how `benchmark` compiles `source_file`, which decides the
+    queries as much as its contents: the compiler and opt, the compile
+    options and the functions the queries are limited to.
+    '''
+    options = oraql_command.compilerOptions(source_file.options + benchmark.options)
+    return oraql_cache.commandKey(
+        [oraql_command.sourceCompiler(benchmark, source_file), oraql_settings.optcommand],
+        [options, oraql_command.onlyFunctionsOption(source_file)], source_file.path)[:16]
+
+def revision(benchmark, source_file):
+    '''
+    The revision of `source_file` as compiled by `benchmark`, its
+    configuration and the digest of its contents. Benchmark files that
+    compile the same source differently, e.g. with OpenMP or MPI, have
+    their own index.
+    '''
+    return f'{configuration(benchmark, source_file)}.{oraql_cache.fileDigest(source_file.path)}'
+
+def sameConfiguration(revision_a, revision_b):
+    return revision_a.split('.')[0] == revision_b.split('.')[0]
+
+def describeUnsafe(index, source_path, rev, seq):
+    '''
+    One line per run of pessimistic queries in `seq`, i.e. the queries the
+    search found unsafe, with where they come from in revision `rev`.
+    '''
+    lines = []
+    start = None
+    for i in range(len(seq) + 1):
+        if i < len(seq) and not seq[i]:
+            if start is None:
+                start = i
+        elif start is not None:
+            lines.append(f'{source_path}.{start}-{i}: {index.describe(source_path, rev, start, i)}')
+            start = None
+    return lines
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show where the optimistic '
+                                     'alias queries of a source file come from.')
+    parser.add_argument('source_file')
+    parser.add_argument('-b', '--benchmark', default='./benchmark.ot',
+                        help='benchmark file that compiles the source file')
+    parser.add_argument('ranges', nargs='*',
+                        help='query ranges START-END to show, all queries if none')
+    parser.add_argument('--functions', action='store_true',
+                        help='list the ranges of queries of each function')
+    args = parser.parse_args()
+    index = openProvenanceIndex()
+    with open(args.benchmark, 'r') as fd:
+        benchmark = dotmap.DotMap(json.load(fd))
+    source_files = [sf for sf in benchmark.source_files if sf.path == args.source_file]
+    if not source_files:
+        print(f'{args.source_file} is not a source file of {args.benchmark}')
+        sys.exit(1)
+    rev = revision(benchmark, source_files[0])
+    if (args.source_file, rev) not in index:
+        print(f'{args.source_file} at its current revision is not indexed')
+        sys.exit(1)
+    if args.functions:
+        for function, start, end in index.functionRanges(args.source_file, rev):
+            print(f'{start}-{end}\t{function}')
+        sys.exit(0)
+    ranges = [(int(r.split('-')[0]), int(r.split('-')[-1]) + ('-' not in r))
+              for r in args.ranges] or [(0, None)]
+    for start, end in ranges:
+        for query, function, line, pass_name in index.queries(args.source_file, rev, start, end):
+            print(f'{query}\t{function}\t{line if line is not None else ""}\t{pass_name or ""}')
@@ -0,0 +1,141 @@
+import copy
+
+class Search:
+    '''
+    Strategy that decides which range of queries to probe next. The driver
+    calls `next` to get a range [start, end) to add to the sequence, probes
+    it, and calls `report` with the outcome. `next` returns None once the
+    search of this source file is done.
+
+    The state must be JSON serializable through `state`/`fromState`, so that
+    the search can be checkpointed after every `report`.
+    '''
+    name = None
+
+    def next(self, problemsize):
+        raise NotImplementedError
+
+    def report(self, success):
+        raise NotImplementedError
+
+    def upcoming(self, problemsize, count):
+        '''
+        The range currently being probed, followed by the ranges that will
+        be probed next if every probe fails. Used to start probes
+        speculatively.
+        '''
+        search = copy.deepcopy(self)
+        ranges = [search.current[:2]]
+        while len(ranges) < count:
+            search.report(False)
+            probe = search.next(problemsize)
+            if probe is None:
+                break
+            ranges.append(probe)
+        return ranges
+
+    def state(self):
+        return {'name': self.name, 'state': vars(self)}
+
+    @staticmethod
+    def fromState(state):
+        search = STRATEGIES[state['name']].__new__(STRATEGIES[state['name']])
+        search.__dict__.update(state['state'])
+        return search
+
+class BisectSearch(Search):
+    '''
+    Add the whole range if that is safe, otherwise bisect it and continue
+    with the left half, then the right half. An `end` of -1 stands for the
+    problem size at the time the range is probed.
+    '''
+    name = 'bisect'
+
+    def __init__(self, start, orig_end):
+        self.pending = [(start, orig_end)]
+        self.current = None
+
+    def next(self, problemsize):
+        if not self.pending:
+            return None
+        start, orig_end = self.pending.pop()
+        end = orig_end
+        if(orig_end == -1):
+            end = problemsize
+        self.current = (start, end, orig_end)
+        return start, end
+
+    def report(self, success):
+        start, end, orig_end = self.current
+        self.current = None
+        if not success:
+            middle = start + (end - start) // 2
+            if(middle > start and middle < end):
+                self.pending.append((middle, orig_end))
+                self.pending.append((start, middle))
+
+class GroupTestingSearch(Search):
+    '''
+    Adaptive group testing. Probes chunks from left to right, doubling the
+    chunk size after every safe chunk. In a failing chunk, the first unsafe
+    query is located by binary search, keeping everything before it. The
+    next chunk size is then the distance between the last two unsafe
+    queries found, an estimate of how dense they are.
+
+    Each unsafe query costs about one failed chunk plus log2(chunk) probes,
+    instead of the two probes per bisection level of BisectSearch.
+    '''
+    name = 'group'
+
+    def __init__(self, start, orig_end):
+        self.pos = start
+        self.last_unsafe = start
+        self.orig_end = orig_end
+        self.chunk = None
+        # [lo, hi) known to contain an unsafe query while locating it
+        self.window = None
+        self.current = None
+
+    def next(self, problemsize):
+        end = problemsize if self.orig_end == -1 else self.orig_end
+        if self.window:
+            lo, hi = self.window
+            self.current = (lo, lo + (hi - lo) // 2)
+        elif self.pos >= end:
+            return None
+        else:
+            if self.chunk is None:
+                self.chunk = end - self.pos
+            self.current = (self.pos, min(self.pos + self.chunk, end))
+        return self.current
+
+    def _unsafe(self, query):
+        self.window = None
+        self.pos = query + 1
+        self.chunk = max(1, query - self.last_unsafe)
+        self.last_unsafe = query
+
+    def report(self, success):
+        start, end = self.current
+        self.current = None
+        if self.window:
+            lo, hi = self.window
+            # whatever is left of a failing window still fails, since the
+            # safe left part is now included in the sequence
+            if success:
+                lo = end
+            else:
+                hi = end
+            if hi - lo == 1:
+                self._unsafe(lo)
+            else:
+                self.window = (lo, hi)
+        elif success:
+            self.pos = end
+            self.chunk *= 2
+        elif end - start == 1:
+            self._unsafe(start)
+        else:
+            self.window = (start, end)
+
+STRATEGIES = {s.name: s for s in (BisectSearch, GroupTestingSearch)}
@@ -0,0 +1,166 @@
+import re
+import sys
+
+# First line of sequence files in the range encoded format
+SEQFILE_HEADER = '# oraql-seq ranges v1'
+
+class BitSeq:
+    '''
+    Sequence of optimistic answers, one bit per query, as passed to the
+    compiler with `-opt-aa-seq`. Query `i` is bit `len - 1 - i` of a Python
+    int, so the digits of the int read in query order.
+
+    Instances are immutable: setting or clearing a range returns a new
+    sequence, keeping a reference is a snapshot, and assigning it back
+    restores it.
+    '''
+    __slots__ = ('bits', 'length')
+
+    def __init__(self, length=0, bits=0):
+        self.bits = bits
+        self.length = length
+
+    @classmethod
+    def fromList(cls, l):
+        return cls.fromString("".join([str(x) for x in l]))
+
+    @classmethod
+    def fromString(cls, s):
+        '''
+        Parse a string of 0 and 1 digits, optionally separated by spaces as
+        in the `-opt-aa-seq` option.
+        '''
+        s = s.replace(' ', '')
+        return cls(len(s), int(s, 2) if s else 0)
+
+    def _mask(self, start, end):
+        start = max(start, 0)
+        end = min(end, self.length)
+        if end <= start:
+            return 0
+        return ((1 << (end - start)) - 1) << (self.length - end)
+
+    def setRange(self, start, end):
+        return BitSeq(self.length, self.bits | self._mask(start, end))
+
+    def clearRange(self, start, end):
+        return BitSeq(self.length, self.bits & ~self._mask(start, end))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError('BitSeq index out of range')
+        return (self.bits >> (self.length - 1 - i)) & 1
+
+    def __iter__(self):
+        return (int(c) for c in self.toString())
+
+    def __eq__(self, other):
+        return (isinstance(other, BitSeq) and self.length == other.length
+                and self.bits == other.bits)
+
+    def __hash__(self):
+        return hash((self.length, self.bits))
+
+    def __repr__(self):
+        return f'BitSeq({self.length}, 0x{self.bits:x})'
+
+    def count(self):
+        return bin(self.bits).count('1')
+
+    @classmethod
+    def fromRanges(cls, text):
+        '''
+        Parse the range encoded form written by `toRanges`.
+        '''
+        digits = []
+        position = 0
+        for run in text.split():
+            match = re.fullmatch(r'(\d+)-(\d+):([01])', run)
+            if not match or int(match.group(1)) != position:
+                raise ValueError(f'Invalid sequence run "{run}"')
+            position = int(match.group(2))
+            digits.append(match.group(3) * (position - int(match.group(1))))
+        return cls.fromString("".join(digits))
+
+    def toRanges(self):
+        '''
+        The sequence as runs of equal answers, "start-end:value" with `end`
+        exclusive, e.g. "0-1200:1 1200-1201:0 1201-4096:1".
+        '''
+        return " ".join([f'{m.start()}-{m.end()}:{m.group()[0]}'
+                         for m in re.finditer('0+|1+', self.toString())])
+
+    def toString(self):
+        if self.length == 0:
+            return ''
+        return format(self.bits, f'0{self.length}b')
+
+    def optAASeq(self):
+        '''
+        The space separated form used by the `-opt-aa-seq` option.
+        '''
+        return ' '.join(self.toString())
+
+    def hex(self, leading_one=False):
+        '''
+        The sequence as a hex number. With `leading_one`, a 1 is put in
+        front of the sequence so that leading zeros are not lost.
+        '''
+        if leading_one:
+            return format(self.bits | (1 << self.length), 'x')
+        return format(self.bits, 'x')
+
+def writeSeqFile(path, seqs):
+    '''
+    Write the sequences in `seqs`, a dict from source file to BitSeq, in the
+    range encoded format: a header line, then one line per source file
+    with its path, a tab, the sequence length and the runs.
+    '''
+    with open(path, 'w') as fd:
+        fd.write(SEQFILE_HEADER + '\n')
+        for source_path, seq in seqs.items():
+            fd.write(f'{source_path}\t{len(seq)} {seq.toRanges()}\n')
+
+def readSeqFile(path, source_paths):
+    '''
+    Read a sequence file, returning a dict from source file to BitSeq. Also
+    reads the older format, a copy of the compiler response file with one
+    `-opt-aa-seq` option per source file, in the order of `source_paths`.
+    '''
+    with open(path, 'r') as fd:
+        content = fd.read()
+    if not content.startswith(SEQFILE_HEADER):
+        seqs = re.findall('-opt-aa-seq="([0 1]*)"', content)
+        return {source_path: BitSeq.fromString(seq)
+                for source_path, seq in zip(source_paths, seqs)}
+    seqs = dict()
+    for line in content.splitlines()[1:]:
+        if not line.strip():
+            continue
+        source_path, line = line.split('\t', 1)
+        length, runs = (line.split(' ', 1) + [''])[:2]
+        seq = BitSeq.fromRanges(runs)
+        if len(seq) != int(length):
+            raise ValueError(f'Sequence of {source_path} in {path} has '
+                             f'{len(seq)} entries, expected {length}')
+        seqs[source_path] = seq
+    return seqs
+
+if __name__ == '__main__':
+    # oraql_seq.py expand|compress FILE [SOURCE_FILE...]
+    #   expand:   print the -opt-aa-seq options of a sequence file
+    #   compress: rewrite an old sequence file in the range encoded format
+    if len(sys.argv) < 3 or sys.argv[1] not in ('expand', 'compress'):
+        print(f'usage: {sys.argv[0]} expand|compress FILE [SOURCE_FILE...]')
+        sys.exit(1)
+    seqs = readSeqFile(sys.argv[2], sys.argv[3:] or ['source'])
+    if sys.argv[1] == 'expand':
+        for source_path, seq in seqs.items():
+            print(f'{source_path}: -opt-aa-seq="{seq.optAASeq()}"')
+    else:
+        writeSeqFile(sys.argv[2], seqs)
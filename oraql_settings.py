@@ -2,3 +2,91 @@ clangcommand = "clang"
 clangppcommand = "clang++"
 flangcommand = "flang"
 optcommand = "opt"
+# Directory for the scratch copies of the benchmark used by parallel probes,
+# None for the system default temporary directory
+scratchdir = None
+# How often a probe of oraql_chunked -j is started again after its worker
+# process died
+probe_retries = 2
+# Directory below the benchmark directory for results and build products
+# that are kept between runs
+cachedir = ".oraql-cache"
+# Maximum number of executables whose verification result is remembered
+resultcache_entries = 100000
+# Maximum number of build products kept in the build cache, by kind:
+# frontend bitcode, object files and passing executables, with which
+# linking is skipped for objects seen before. The least recently used are
+# removed.
+buildcache_limits = {".bc": 64, ".o": 1024, ".exe": 16}
+# Check the output of a benchmark line by line while it runs and stop it at
+# the first mismatch. Can be overridden with "stream_verify" per i/o pair.
+streamverify = True
+# Timing of configurations in oraql_identify_important: discarded warm-up
+# runs, the number of measured runs for the baseline and the minimum and
+# maximum for other configurations, which get runs added until the
+# confidence interval of the difference to the baseline, computed from
+# `timing_resamples` bootstrap resamples, allows a decision
+timing_warmup = 1
+timing_baseline_runs = 10
+timing_min_runs = 3
+timing_max_runs = 10
+timing_confidence = 0.95
+timing_resamples = 1000
+# Hardware counters collected with `perf stat` for the timed runs of
+# oraql_identify_important
+perfcommand = "perf"
+perfcounters = False
+perf_events = ["cycles", "instructions", "branch-misses", "task-clock"]
+# Metric oraql_identify_important compares configurations by: "time" for
+# the wall clock time, "cycles", or "ipc", compared as cycles per
+# instruction so that lower is better for all metrics. The last two
+# collect counters even if perfcounters is off.
+timing_metric = "time"
+# Used to bind the memory of benchmark runs to the "numa_node" of the
+# benchmark file
+numactlcommand = "numactl"
+# File in the benchmark directory that gets a JSON record for every probe,
+# None to disable. Summarize it with `python3 oraql_events.py`.
+eventlog = "oraql-events.jsonl"
+# Option of the optimistic AA pass that limits optimistic answers, and with
+# them the queries counted and searched, to the functions given as
+# "only_functions" of a source file. Passed as
+# <option>=<comma separated names>; needs a compiler that supports it,
+# e.g. "-opt-aa-only-functions". None searches all functions.
+onlyfunctionsoption = None
+# Option that makes the optimistic AA pass describe every query it answers
+# in its debug output, and the pattern that extracts the query index and,
+# if present, the function, source line and pass from it. The description
+# is requested in the initial build of oraql_chunked and indexed in the
+# cache directory, see oraql_provenance. None disables the index; the
+# option needs a compiler that supports it.
+provenanceoption = None
+provenance_pattern = r"^optimisticaa query (?P<index>\d+) in (?P<function>\S+)(?: at line (?P<line>\d+))?(?: from (?P<pass>\S+))?"
+# Profile-guided search order in oraql_identify_important: the initial
+# executable is sampled once with `perf record` at `profile_frequency` Hz,
+# and the queries of the `profile_top_functions` hottest functions, found
+# in the provenance index (see provenanceoption), are searched first,
+# hottest function first. With profile_hot_only, the remaining queries are
+# not searched at all.
+profile_search = False
+profile_top_functions = 10
+profile_hot_only = False
+profile_frequency = 999
+# Maximum number of parallel probe workers of oraql_chunked that may be in
+# a stage of their probe at the same time, None for no limit. Limiting
+# "run" to fewer workers than jobs pipelines the probes: the benchmark runs
+# for the probe the search needs while the others compile the ranges that
+# are likely to follow. One slot of each limited stage is kept for the probe
+# the search waits for. The "run" limit can be given with --run-jobs, and
+# the CPUs are split into one core set per run slot.
+stage_limits = {"compile": None, "link": None, "run": None}
+# Distributed probing of oraql_chunked (--listen and --worker): file with
+# the key that workers authenticate with, unless ORAQL_AUTHKEY is set, which
+# the coordinator creates with a random key, readable by its owner only;
+# how long a peer may take to authenticate, in seconds; how often a probe
+# is handed to another worker after its worker was lost; and how long a
+# worker tries to reach a coordinator that is not listening yet, in seconds
+distributed_authkey_file = "~/.oraql-authkey"
+distributed_handshake_timeout = 30
+distributed_retries = 3
+distributed_connect_timeout = 600
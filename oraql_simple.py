@@ -1,6 +1,11 @@
 import json
 import dotmap
 import oraql_settings
+import oraql_cache
+import oraql_verify
+import oraql_affinity
+import oraql_events
+import oraql_command
 import sys
 import os
 import logging as log
@@ -68,14 +73,31 @@ def compileFile(benchmark, source_file, seq):
     compiler = oraql_settings.clangcommand
     if source_file.path.endswith('.cc') or source_file.path.endswith('.cpp'):
         compiler =  oraql_settings.clangppcommand
-    options = source_file.options + benchmark.options
+    options = oraql_command.compilerOptions(source_file.options + benchmark.options)
     try:
         seqstr = " ".join([str(x[0])+" "+str(x[1]) for x in seq])
-        cmd = " ".join([*options, '-O3', '-mllvm', '-stats', '-v', '-mllvm', f'-optimistic-aa-seq="{seqstr}"', '-flegacy-pass-manager'])
+        cmd = " ".join([oraql_command.commandLine(options), '-O3', '-mllvm', '-stats', '-v', '-mllvm', f'-optimistic-aa-seq="{seqstr}"', '-flegacy-pass-manager'])
+        only_functions = oraql_command.onlyFunctionsOption(source_file)
+        if only_functions:
+            cmd += f' -mllvm {only_functions}'
+        # reuse the object file if this file was compiled with the same
+        # sequence before
+        o_outfile = oraql_cache.objectPath(options, source_file.path)
+        key = oraql_cache.commandKey([compiler], cmd, source_file.path)
+        reused, problemsize = _build_cache.restore(key, '.o', o_outfile)
+        oraql_events.cacheLookup('object', reused)
+        if reused:
+            logger.debug(f'  Reusing object file of {source_file.path} with {seq}')
+            return True, problemsize
+        depfile = o_outfile + '.d'
+        dep_options = oraql_cache.depfileOptions(source_file.path, depfile)
         with tempfile.NamedTemporaryFile() as fp:
           fp.write(bytes(cmd, 'utf-8'))
           fp.flush()
-          run_result = sp.run(f'{compiler} @{fp.name} {source_file.path}', shell=True, stdout=PIPE, stderr=PIPE)
+          with oraql_events.phase('compile'):
+              run_result = oraql_command.run([*oraql_command.splitCommand(compiler), f'@{fp.name}',
+                                              *dep_options, source_file.path], stdout=PIPE, stderr=PIPE)
+          oraql_events.exitCode('compile', run_result.returncode)
 
           if run_result.returncode != 0:
             logger.debug(f'   - Compile error, exit code was '
@@ -96,8 +118,13 @@ def compileFile(benchmark, source_file, seq):
     except Exception as e:
         logger.warning(f'Did not find optimistic AA statistics in compiler stderr. Did you build LLVM with OptimisticAA support?')
         return False, 0
+    _build_cache.store(key, '.o', o_outfile, oraql_cache.readDeps(source_file.path, depfile), problemsize)
     return True, problemsize
 
+def objectFiles(benchmark):
+    return [oraql_cache.objectPath(oraql_command.compilerOptions(sf.options + benchmark.options), sf.path)
+            for sf in benchmark.source_files]
+
 def linkExecutable(benchmark):
     executable_path = benchmark.executable
     if os.path.isfile(executable_path):
@@ -105,16 +132,19 @@ def linkExecutable(benchmark):
         os.remove(executable_path)
 
     try: 
-        cmd = [benchmark.make_cmd]
-        run_result = sp.run(cmd, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+        cmd = oraql_command.buildCommand(benchmark, objectFiles(benchmark))
+        logger.debug(f'  Link with {oraql_command.commandLine(cmd)}')
+        with oraql_events.phase('link'):
+            run_result = oraql_command.run(cmd, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+        oraql_events.exitCode('link', run_result.returncode)
         if run_result.returncode != 0:
             logger.warn(f'   - Make command error, exit code was '
                         f'{run_result.returncode}:\n'
-                        f'     - Command: {" ".join(cmd)}')
+                        f'     - Command: {oraql_command.commandLine(cmd)}')
             return False
     except Exception as e:
         logger.warn(f'   - Make command error:\n'
-                    f'     - Command: {" ".join(cmd)}\n'
+                    f'     - Command: {oraql_command.commandLine(cmd)}\n'
                     f'     - {e!s}')
         return False
     logger.debug(f' Making {executable_path}')
@@ -131,15 +161,26 @@ def moveExecutable(benchmark, version):
 
 def runAndVerify(benchmark, io_pair):
     cmd = [benchmark.executable]+io_pair.input
+    matcher = oraql_verify.outputMatcher(io_pair)
+
+    cmd, env, cpus = oraql_affinity.runSettings(benchmark, cmd)
     logger.debug(f'    - Run command "{" ".join(cmd)}"')
+    stream = oraql_verify.streamToCheck(io_pair, matcher)
     try:
-        run_result = sp.run(cmd, timeout=io_pair.timeout, stdout=PIPE, stderr=PIPE)
-    except sp.TimeoutExpired:
-        logger.debug(f'     - Run failed due to time out ({io_pair.timeout}s)')
-        return False
+        with oraql_events.phase('run'):
+            run_result = oraql_verify.runProcess(cmd, io_pair.timeout, stream, matcher.checkLine,
+                                                 env=env, cpus=cpus)
     except Exception as e:
         logger.warn(f'     - Run failed due to unknown error:\n{e!s}')
         return False
+    if run_result.timed_out:
+        logger.debug(f'     - Run failed due to time out ({io_pair.timeout}s)')
+        return False
+    if run_result.aborted_at is not None:
+        logger.debug(f'     - Run aborted, line {run_result.aborted_at + 1} of '
+                     f'{stream} did not match expected pattern')
+        return False
+    oraql_events.exitCode('run', run_result.returncode)
 
     logger.debug(f'    - Check return value')
     if run_result.returncode is not io_pair.returncode:
@@ -149,8 +190,9 @@ def runAndVerify(benchmark, io_pair):
 
     logger.debug(f'    - Collect run output')
     run_output = ''
-    if os.path.isfile('output.txt'):
-        with open('output.txt', 'r') as fd:
+    output_file = io_pair.get('output_file', 'output.txt')
+    if os.path.isfile(output_file):
+        with open(output_file, 'r') as fd:
             run_output = fd.read()
     else:
         if io_pair.use_stdout:
@@ -159,29 +201,24 @@ def runAndVerify(benchmark, io_pair):
             run_output += run_result.stderr.decode('utf8')
 
     logger.debug(f'    - Try to match output with expected pattern')
-    expected_output = io_pair.output
-    if os.path.isfile(io_pair.output):
-        with open(io_pair.output, 'r') as fd:
-            expected_output = fd.read()
-
-    match = re.fullmatch(expected_output, run_output)
-    if match:
+    with oraql_events.phase('verify'):
+        matched = matcher.match(run_output)
+    if matched:
         logger.debug(f'    - Output matched expected pattern '
-                     f'{len(expected_output)} vs {len(run_output)}')
+                     f'{len(matcher.expected_output)} vs {len(run_output)}')
         return True
 
-    logger.debug(f'    - Output "%s" did not match expected pattern "%s"'%(run_output, expected_output))
+    logger.debug(f'    - Output "%s" did not match expected pattern "%s"'%(run_output, matcher.expected_output))
     return False
 
-import hashlib
-def md5(fname):
-  hash_md5 = hashlib.md5()
-  with open(fname, "rb") as f:
-    for chunk in iter(lambda: f.read(4096), b""):
-      hash_md5.update(chunk)
-  return hash_md5.hexdigest()
-
+# Results of previously verified executables, see oraql_cache.ResultCache
 _seen_before = dict()
+# Object files of previous compiles, see oraql_cache.BuildCache
+_build_cache = None
+# Hash of the executable linked from objects, by oraql_cache.objectsFingerprint
+_linked = dict()
+
+@oraql_events.probe
 def compileAndRunOneConfiguration(benchmark, seqs, problemsizes):
     global _seen_before
     # compile individual files into object files
@@ -194,19 +231,22 @@ def compileAndRunOneConfiguration(benchmark, seqs, problemsizes):
             return False, problemsizes
 
     # link object files into executable
-    success = linkExecutable(benchmark)
-    if not success:
+    md5sum = oraql_cache.linkOrReuse(benchmark, objectFiles(benchmark), linkExecutable,
+                                     _linked, _seen_before, _build_cache)
+    if md5sum is None:
         logger.info(f'Failed linking with seq {seqs}')
         return False, problemsizes
     logger.debug(f'    Compiled. Compare executable file to previously seen files')
-    md5sum = md5(benchmark.executable)
-    if(md5sum in _seen_before):
-        if not _seen_before[md5sum]["res"]:
+    seen = _seen_before.get(md5sum)
+    oraql_events.cacheLookup('result', seen is not None)
+    if seen is not None:
+        problemsizes = oraql_cache.mergeProblemSizes(problemsizes, seen["problemsizes"])
+        if not seen["res"]:
             logger.debug(f'   We have seen this executable previously, and it was a failure.')
-            return False, _seen_before[md5sum]["problemsizes"]
+            return False, problemsizes
         else:
             logger.debug(f'   We have seen this executable previously, and it was a success.')
-            return True, _seen_before[md5sum]["problemsizes"]
+            return True, problemsizes
     logger.debug(f'    This is a new executable, continue with verification.')
 
     # run the generated executable for each input/output pair
@@ -223,6 +263,7 @@ def compileAndRunOneConfiguration(benchmark, seqs, problemsizes):
     # input/output pair. Success!
     logger.info(f'Successful test for all i/o pairs with seq {seqs}')
     _seen_before[md5sum] = {"res": True, "problemsizes": problemsizes}
+    _build_cache.store(md5sum, '.exe', benchmark.executable, [])
     return True, problemsizes
 
 def compileAndRunAllConfigurations(benchmark, problemsizes):
@@ -241,6 +282,7 @@ def split_n_try(n, shift, seqs, source_file, benchmark, problemsizes, skipLevel
   success = False
   if(not skipLevel):
     seqs[source_file.path] = [(n,shift)]+seqs[source_file.path]
+    oraql_events.setContext(source=source_file.path, pair=[n, shift])
     success, problemsizes = compileAndRunOneConfiguration(benchmark, seqs, problemsizes)
     if success:
       return seqs, problemsizes
@@ -259,13 +301,25 @@ def split_n_try(n, shift, seqs, source_file, benchmark, problemsizes, skipLevel
   return seqs, problemsizes
 
 def runBenchmark(benchmark_file):
+    global _seen_before, _build_cache
     benchmark = readBenchmarkFile(benchmark_file)
     logger.info(f'Start benchmark {benchmark.name}')
+    _seen_before = oraql_cache.openResultCache(benchmark)
+    _build_cache = oraql_cache.openBuildCache()
+    oraql_command.configure(benchmark)
+    if not oraql_command.prepareLink(benchmark):
+        logger.error(f'Failed to build the prebuilt objects with {benchmark.link.prepare_cmd}')
+        return False
+    core_sets = oraql_affinity.coreSets(benchmark, 1)
+    oraql_affinity.assignCpus(core_sets[0] if core_sets else None)
     benchmark_path = os.path.dirname(benchmark_file)
+    oraql_events.openEventLog(oraql_settings.eventlog, driver='simple',
+                              benchmark=benchmark.name)
 
     success = False
     seqs = {x.path:[] for x in benchmark.source_files}
     problemsizes = {x.path:0 for x in benchmark.source_files}
+    oraql_events.setContext(initial=True)
     success, problemsizes = compileAndRunOneConfiguration(benchmark, seqs, problemsizes)
     if success:
         logger.info(f'- Initial build successful, proceed to '
@@ -280,17 +334,22 @@ def runBenchmark(benchmark_file):
     logger.info(f'Finished benchmark {benchmark.name}, '
                 f'{"" if success else "un"}successful')
     logger.info(f'Final sequence: {seqs}')
+    return success
 
 benchmark_files = ['./benchmark.ot']
 
 if len(sys.argv) > 1:
     benchmark_files = sys.argv[1:]
 
+# exit nonzero if any search failed, e.g. for oraql_batch
+failed = False
 base_path = os.path.abspath(os.curdir)
 for benchmark_file in benchmark_files:
     os.chdir(base_path)
     try:
-        runBenchmark(benchmark_file)
+        failed = not runBenchmark(benchmark_file) or failed
     except Exception as e:
+        failed = True
         logger.error(f' The execution of {benchmark_file} ended in an '
                      f' uncaught exception:\n{e!s}', exc_info=True)
+sys.exit(1 if failed else 0)
@@ -0,0 +1,98 @@
+import random
+import statistics
+
+import oraql_settings
+
+def median(samples):
+    return statistics.median(samples)
+
+def fastest(*sample_lists):
+    return min(sample_lists, key=median)
+
+def relativeDifference(baseline, samples):
+    '''
+    Difference of the median of `samples` to the median of `baseline`, in
+    percent of the latter. Positive if `samples` are slower.
+    '''
+    return 100 * (median(samples) / median(baseline) - 1)
+
+def confidenceInterval(baseline, samples, confidence=None, resamples=None):
+    '''
+    Bootstrap confidence interval of `relativeDifference`. The random
+    generator is seeded the same way every time, so the same samples always
+    lead to the same decision.
+    '''
+    confidence = confidence or oraql_settings.timing_confidence
+    resamples = resamples or oraql_settings.timing_resamples
+    rng = random.Random(0)
+    differences = sorted(
+        relativeDifference(rng.choices(baseline, k=len(baseline)),
+                           rng.choices(samples, k=len(samples)))
+        for _ in range(resamples))
+    tail = (1 - confidence) / 2
+    return (differences[int(tail * (resamples - 1))],
+            differences[int(round((1 - tail) * (resamples - 1)))])
+
+def verdict(baseline, samples, threshold):
+    '''
+    True if the runtimes differ by more than `threshold` percent, False if
+    they differ by less, and None while the confidence interval still
+    overlaps the threshold.
+    '''
+    if len(baseline) < 2 or len(samples) < 2:
+        return None
+    low, high = confidenceInterval(baseline, samples)
+    if low > threshold or high < -threshold:
+        return True
+    if low > -threshold and high < threshold:
+        return False
+    return None
+
+def differs(baseline, samples, threshold):
+    '''
+    `verdict`, falling back to comparing the medians when the samples did
+    not allow a decision.
+    '''
+    decided = verdict(baseline, samples, threshold)
+    if decided is None:
+        return abs(relativeDifference(baseline, samples)) >= threshold
+    return decided
+
+def _warmUp(run):
+    for _ in range(oraql_settings.timing_warmup):
+        if run() is None:
+            return False
+    return True
+
+def measure(run, count, samples=(), warm_up=None):
+    '''
+    Extend `samples` to `count` runtimes by calling `run`, which returns
+    the runtime of one run or None if it failed. Warm-up runs are made
+    before the first new sample, with `warm_up` instead of `run` if given.
+    Returns the samples, or None if a run failed.
+    '''
+    return measureAgainst(run, None, None, samples, count, warm_up)
+
+def measureAgainst(run, baseline, threshold, samples=(), count=None, warm_up=None):
+    '''
+    Like `measure`, but adaptive: after the minimum number of runs, keep
+    adding runs until `verdict` can tell whether the runtime differs from
+    `baseline` by more than `threshold` percent, or the maximum number of
+    runs is reached.
+    '''
+    samples = list(samples)
+    def needMore():
+        if count is not None:
+            return len(samples) < count
+        if len(samples) < oraql_settings.timing_min_runs:
+            return True
+        return (len(samples) < oraql_settings.timing_max_runs
+                and verdict(baseline, samples, threshold) is None)
+    if needMore() and not _warmUp(warm_up or run):
+        return None
+    while needMore():
+        time = run()
+        if time is None:
+            return None
+        samples.append(time)
+    return samples
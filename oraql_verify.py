@@ -0,0 +1,330 @@
+import os
+import re
+import time
+import select
+import signal
+import selectors
+import collections
+import subprocess as sp
+from subprocess import PIPE
+
+import oraql_settings
+
+try:
+    from re import _parser as _sre_parse, _constants as _sre
+except ImportError:
+    import sre_parse as _sre_parse, sre_constants as _sre
+
+# Resources used by a run: wall clock, user and system time in seconds, and
+# the maximum resident set size in KiB
+RunTimes = collections.namedtuple('RunTimes', ['wall', 'user', 'sys', 'maxrss'])
+
+class RunResult:
+    '''
+    Outcome of `runProcess`. `returncode` is None if the process was killed
+    because it timed out or because its output diverged (`aborted_at` is
+    then the index of the first line that did not match). `times` is the
+    RunTimes of the run and `counters` the values of the hardware counters
+    if they were collected, see perfCommand.
+    '''
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.returncode = None
+        self.stdout = b''
+        self.stderr = b''
+        self.timed_out = False
+        self.aborted_at = None
+        self.times = None
+        self.counters = None
+
+class OutputMatcher:
+    '''
+    Expected output of an input/output pair, compiled once: `pattern` for
+    the whole output, and one pattern per line for checking output while it
+    streams in and for reporting which lines differ. `lines` is None if the
+    expected output cannot be matched line by line, e.g. because a group
+    spans several lines or a line can match a line break, as in "x\s+y".
+    '''
+    def __init__(self, expected_output):
+        self.expected_output = expected_output
+        self.pattern = re.compile(expected_output)
+        try:
+            self.lines = [re.compile(line) for line in expected_output.splitlines()]
+        except re.error:
+            self.lines = None
+        if self.lines and any(_matchesLineBreak(line) for line in self.lines):
+            self.lines = None
+
+    def match(self, output):
+        return self.pattern.fullmatch(output) is not None
+
+    def checkLine(self, index, line):
+        '''
+        Whether the `index`th output line matches its line of the expected
+        output. Lines beyond the end of the expected output are left to the
+        check of the whole output.
+        '''
+        return index >= len(self.lines) or self.lines[index].fullmatch(line) is not None
+
+    def mismatches(self, output):
+        '''
+        Pairs of expected pattern and output line that do not match.
+        '''
+        if self.lines is None:
+            return []
+        return [(pattern.pattern, line)
+                for pattern, line in zip(self.lines, output.splitlines())
+                if not pattern.fullmatch(line)]
+
+_NEWLINE = ord('\n')
+# Character categories of sets that contain the line break
+_NEWLINE_CATEGORIES = {_sre.CATEGORY_SPACE, _sre.CATEGORY_NOT_DIGIT,
+                       _sre.CATEGORY_NOT_WORD, _sre.CATEGORY_LINEBREAK,
+                       _sre.CATEGORY_UNI_SPACE, _sre.CATEGORY_UNI_NOT_DIGIT,
+                       _sre.CATEGORY_UNI_NOT_WORD, _sre.CATEGORY_UNI_LINEBREAK}
+
+def _setMatchesLineBreak(items):
+    negate = False
+    matches = False
+    for op, av in items:
+        if op is _sre.NEGATE:
+            negate = True
+        elif op is _sre.LITERAL:
+            matches |= av == _NEWLINE
+        elif op is _sre.RANGE:
+            matches |= av[0] <= _NEWLINE <= av[1]
+        elif op is _sre.CATEGORY:
+            matches |= av in _NEWLINE_CATEGORIES
+        else:
+            matches = True
+    return matches != negate
+
+def _parsedMatchesLineBreak(items, dotall):
+    for op, av in items:
+        if op in (_sre.AT, _sre.ASSERT, _sre.ASSERT_NOT):
+            # anchors and lookarounds do not consume characters
+            continue
+        if op is _sre.LITERAL:
+            found = av == _NEWLINE
+        elif op is _sre.NOT_LITERAL:
+            found = av != _NEWLINE
+        elif op is _sre.ANY:
+            found = dotall
+        elif op is _sre.IN:
+            found = _setMatchesLineBreak(av)
+        elif op in (_sre.MAX_REPEAT, _sre.MIN_REPEAT) or op is getattr(_sre, 'POSSESSIVE_REPEAT', None):
+            found = _parsedMatchesLineBreak(av[2], dotall)
+        elif op is _sre.SUBPATTERN:
+            _, add_flags, del_flags, pattern = av
+            scoped = (dotall or add_flags & re.DOTALL) and not del_flags & re.DOTALL
+            found = _parsedMatchesLineBreak(pattern, scoped)
+        elif op is _sre.BRANCH:
+            found = any(_parsedMatchesLineBreak(branch, dotall) for branch in av[1])
+        elif op is getattr(_sre, 'ATOMIC_GROUP', None):
+            found = _parsedMatchesLineBreak(av, dotall)
+        else:
+            # e.g. back references, which may match anything
+            found = True
+        if found:
+            return True
+    return False
+
+def _matchesLineBreak(pattern):
+    '''
+    Whether the compiled regular expression `pattern` can match text that
+    contains a line break, in which case its line cannot be checked alone.
+    '''
+    return _parsedMatchesLineBreak(_sre_parse.parse(pattern.pattern),
+                                   bool(pattern.flags & re.DOTALL))
+
+_matchers = dict()
+
+def outputMatcher(io_pair):
+    '''
+    The OutputMatcher of `io_pair`, whose output is either the name of a
+    file with the expected output or the expected output itself. Files are
+    read and compiled once per absolute path.
+    '''
+    key = io_pair.output
+    from_file = os.path.isfile(io_pair.output)
+    if from_file:
+        key = os.path.abspath(io_pair.output)
+    if key not in _matchers:
+        expected_output = io_pair.output
+        if from_file:
+            with open(io_pair.output, 'r') as fd:
+                expected_output = fd.read()
+        _matchers[key] = OutputMatcher(expected_output)
+    return _matchers[key]
+
+def streamToCheck(io_pair, matcher):
+    '''
+    The stream whose output starts the expected output, and can therefore
+    be checked line by line while the benchmark runs, or None. Streaming can
+    be disabled globally or per input/output pair with "stream_verify":
+    false. It is also skipped if `matcher` cannot match line by line and
+    for input/output pairs whose benchmark writes its output to the file
+    named by "output_file", e.g. output.txt.
+    '''
+    if not io_pair.get('stream_verify', oraql_settings.streamverify):
+        return None
+    if matcher.lines is None or io_pair.get('output_file'):
+        return None
+    if io_pair.use_stdout:
+        return 'stdout'
+    if io_pair.use_stderr:
+        return 'stderr'
+    return None
+
+def perfCommand(cmd, log_fd):
+    '''
+    `cmd` wrapped in `perf stat`, writing the counters in CSV format to the
+    file descriptor `log_fd`, so that the output of `cmd` is left alone.
+    '''
+    return [oraql_settings.perfcommand, 'stat', '-x', ',', '--log-fd',
+            str(log_fd), '-e', ','.join(oraql_settings.perf_events), '--'] + cmd
+
+def parsePerfStat(output):
+    '''
+    The counter values in the CSV output of `perf stat -x ,`, by event name.
+    Counts of the same event on different kinds of cores are added up,
+    events that were not counted are left out.
+    '''
+    counters = dict()
+    for line in output.splitlines():
+        fields = line.split(',')
+        if len(fields) < 3 or line.startswith('#'):
+            continue
+        try:
+            value = float(fields[0])
+        except ValueError:
+            continue
+        # cycles:u, cpu_core/cycles/ and the like
+        event = re.sub(r'^[\w-]+/([^/]+)/$', r'\1', fields[2]).split(':')[0]
+        counters[event] = counters.get(event, 0) + value
+    return counters
+
+def _kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def _exitsBy(proc, deadline):
+    '''
+    Whether `proc` exits before `deadline`, without reaping it.
+    '''
+    try:
+        fd = os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):
+        fd = None
+    if fd is not None:
+        try:
+            readable, _, _ = select.select([fd], [], [], max(0, deadline - time.monotonic()))
+            return bool(readable)
+        finally:
+            os.close(fd)
+    while time.monotonic() < deadline:
+        if os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT):
+            return True
+        time.sleep(0.01)
+    return False
+
+def _wait(proc):
+    '''
+    Wait for `proc` like Popen.wait, but also return the resources used by
+    it and the children it waited for.
+    '''
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, usage
+
+def runProcess(cmd, timeout=None, check_stream=None, check_line=None, counters=False,
+               env=None, cpus=None):
+    '''
+    Run `cmd` and collect its stdout and stderr. Every complete line that
+    arrives on `check_stream` is passed to `check_line(index, line)`; on the
+    first line for which it returns False, the process and everything it
+    started are killed instead of waiting for the run to end. The run is
+    timed in this process, with the resource usage reported by wait4. With
+    `counters`, hardware counters are collected with `perf stat`. The
+    process runs with the environment `env` and, if given, pinned to the
+    CPUs `cpus`.
+    '''
+    result = RunResult(cmd)
+    perf_log = None
+    pass_fds = ()
+    if counters:
+        read_fd, write_fd = os.pipe()
+        perf_log = os.fdopen(read_fd, 'rb')
+        pass_fds = (write_fd,)
+        cmd = perfCommand(cmd, write_fd)
+    start = time.perf_counter()
+    # own session, so that mpirun and the ranks it starts can be killed too
+    try:
+        proc = sp.Popen(cmd, stdout=PIPE, stderr=PIPE, start_new_session=True,
+                        pass_fds=pass_fds, env=env,
+                        preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None)
+    except Exception:
+        if perf_log:
+            perf_log.close()
+        raise
+    finally:
+        for fd in pass_fds:
+            os.close(fd)
+    buffers = {proc.stdout: bytearray(), proc.stderr: bytearray()}
+    if perf_log:
+        buffers[perf_log] = bytearray()
+    checked = getattr(proc, check_stream) if check_stream and check_line else None
+    line_start = 0
+    line_index = 0
+    deadline = time.monotonic() + timeout if timeout else None
+
+    selector = selectors.DefaultSelector()
+    for stream in buffers:
+        selector.register(stream, selectors.EVENT_READ)
+    with selector:
+        while selector.get_map() and result.aborted_at is None:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    result.timed_out = True
+                    break
+            for key, _ in selector.select(remaining):
+                data = os.read(key.fd, 1 << 16)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    continue
+                buffers[key.fileobj] += data
+                if key.fileobj is not checked:
+                    continue
+                buffer = buffers[checked]
+                end = buffer.find(b'\n', line_start)
+                while end >= 0:
+                    line = buffer[line_start:end].decode('utf8', errors='replace')
+                    if not check_line(line_index, line):
+                        result.aborted_at = line_index
+                        break
+                    line_index += 1
+                    line_start = end + 1
+                    end = buffer.find(b'\n', line_start)
+    # the process may have closed its output and still be running
+    if (deadline is not None and not result.timed_out and result.aborted_at is None
+            and not _exitsBy(proc, deadline)):
+        result.timed_out = True
+    if result.timed_out or result.aborted_at is not None:
+        _kill(proc)
+    returncode, usage = _wait(proc)
+    result.times = RunTimes(time.perf_counter() - start, usage.ru_utime,
+                            usage.ru_stime, usage.ru_maxrss)
+    proc.stdout.close()
+    proc.stderr.close()
+    if perf_log:
+        perf_log.close()
+        result.counters = parsePerfStat(buffers[perf_log].decode('utf8', errors='replace'))
+    if not result.timed_out and result.aborted_at is None:
+        result.returncode = returncode
+    result.stdout = bytes(buffers[proc.stdout])
+    result.stderr = bytes(buffers[proc.stderr])
+    return result